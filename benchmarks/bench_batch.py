@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# benchmarks how many statements a second the console runs from --batch input, against the
+#  same input piped to the interactive console, which reads it a line at a time through
+#  raw_input() and prints a prompt for each line
+# each kind of statement is timed from inside the console, so startup isn't counted
+# usage: python benchmarks/bench_batch.py [--statements 20000] [--repeat 3]
+import os, sys
+import re, shutil, tempfile, subprocess, argparse
+
+repo_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir, os.pardir))
+
+# statements that print nothing, statements that print a line, and a special command
+kinds = (('assignment', 'bench_x = 1'), ('print', 'print bench_x'), ('command', 'cd .'))
+
+# returns the console input for one measurement
+def session(statement, statements):
+    lines = ['import time', 'bench_x = 1', 'bench_start = time.time()']
+    lines += [statement] * statements
+    lines.append("print 'elapsed', time.time() - bench_start")
+    return '\n'.join(lines) + '\n'
+
+# runs the console with the input and returns the statements run a second
+def measure(python, work_dir, statement, statements, extra_args):
+    process = subprocess.Popen([python, os.path.join(repo_dir, 'python_console.py'),
+                                '--log', os.path.join(work_dir, 'bench.log'), '--restart_log'] + extra_args,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=work_dir)
+    out = process.communicate(session(statement, statements))[0]
+    return statements / float(re.search(r'elapsed ([0-9.e-]+)', out).group(1))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks batch mode against the interactive console.')
+    parser.add_argument('--statements', type=int, default=20000, help='Statements timed per measurement.')
+    parser.add_argument('--repeat', type=int, default=3, help='Measurements per mode, of which the best is shown.')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter used to run the console.')
+    parser.add_argument('--no_structured_log', action='store_true', help='Include to run the console with --no_structured_log.')
+    args = parser.parse_args()
+
+    extra_args = ['--no_structured_log'] if args.no_structured_log else []
+    modes = (('interactive', []), ('batch', ['--batch', '-']), ('batch jsonl', ['--batch', '-', '--batch_format', 'jsonl']))
+    work_dir = tempfile.mkdtemp(prefix='pycon_bench_')
+    try:
+        print '{:<12s}{:>14s}{:>14s}{:>14s}'.format('statement', *[mode for mode, _ in modes])
+        for kind, statement in kinds:
+            rates = []
+            for mode, mode_args in modes:
+                rates.append(max(measure(args.python, work_dir, statement, args.statements, extra_args + mode_args)
+                                 for _ in range(args.repeat)))
+            print '{:<12s}{:>14.0f}{:>14.0f}{:>14.0f}'.format(kind, *rates)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# benchmarks the cost of running a special command as the console's namespace grows
+# for each size, launches the console, fills its namespace with that many variables, then
+#  times a run of "cd ." commands from inside the console. the per command cost should
+#  stay flat as the namespace grows
+# the garbage collector is disabled while timing, since its full collections walk the
+#  whole namespace no matter what the console does. --keep_gc leaves it on
+# usage: python benchmarks/bench_namespace.py [--sizes 1000 10000 100000 1000000] [--commands 2000]
+import os, sys
+import re, shutil, tempfile, subprocess, argparse
+
+repo_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir, os.pardir))
+
+# returns the console input for one measurement
+def session(size, commands, keep_gc):
+    lines = ["globals().update(('bench_variable_%d' % i, i) for i in xrange({:d}))".format(size),
+             'import time, gc']
+    if not keep_gc:
+        lines.append('gc.disable()')
+    lines.append('bench_start = time.time()')
+    lines += ['cd .'] * commands
+    lines.append("print 'elapsed', time.time() - bench_start")
+    return '\n'.join(lines) + '\n'
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks special commands against namespace size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='Numbers of variables in the namespace.')
+    parser.add_argument('--commands', type=int, default=2000, help='Commands timed per size.')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter used to run the console.')
+    parser.add_argument('--keep_gc', action='store_true', help='Include to leave the garbage collector on while timing.')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='pycon_bench_')
+    try:
+        print '{:<10s}{:>16s}'.format('size', 'usec/command')
+        for size in args.sizes:
+            process = subprocess.Popen([args.python, os.path.join(repo_dir, 'python_console.py'),
+                                        '--log', os.path.join(work_dir, 'bench.log')],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       cwd=work_dir)
+            out = process.communicate(session(size, args.commands, args.keep_gc))[0]
+            elapsed = float(re.search(r'elapsed ([0-9.e-]+)', out).group(1))
+            print '{:<10d}{:>16.1f}'.format(size, elapsed / args.commands * 1e6)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
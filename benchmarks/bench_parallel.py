@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# benchmarks how pmap() scales with the number of workers, against the built-in map()
+# a CPU-bound function shows the scaling across cores with process workers (and the lack of
+#  it with thread workers, which share the GIL), and a cheap function shows the cost of
+#  sending items and results between processes, which the automatic chunking keeps down
+# usage: python benchmarks/bench_parallel.py [--items 200000] [--workers 1,2,4,8] [--repeat 3]
+import os, sys
+import imp, time, argparse
+
+repo_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir, os.pardir))
+console_parallel = imp.load_source('console_parallel', os.path.join(repo_dir, 'console_parallel.py'))
+
+# about 20us of python code an item
+def busy(x):
+    total = 0
+    for i in xrange(200):
+        total += i * x
+    return total
+
+def cheap(x):
+    return x * 2
+
+# returns the best time of repeat runs of function
+def best(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks pmap() with different numbers of workers.')
+    parser.add_argument('--items', type=int, default=200000, help='Items mapped per measurement.')
+    parser.add_argument('--workers', default=None, help='Comma-separated worker counts to measure. Default is powers of two up to the number of cores.')
+    parser.add_argument('--repeat', type=int, default=3, help='Measurements per setting, of which the best is shown.')
+    args = parser.parse_args()
+
+    cores = console_parallel.cpu_count()
+    if args.workers:
+        counts = [int(count) for count in args.workers.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= cores:
+            counts.append(counts[-1] * 2)
+        if counts[-1] != cores:
+            counts.append(cores)
+    items = range(args.items)
+    print '{:d} items on {:d} cores, items a second (speedup over map)'.format(args.items, cores)
+    for name, function in (('busy', busy), ('cheap', cheap)):
+        serial = args.items / best(lambda: map(function, items), args.repeat)
+        print '{:s}: map {:.0f}'.format(name, serial)
+        print '  {:>8s}{:>20s}{:>20s}'.format('workers', 'processes', 'threads')
+        for count in counts:
+            rates = []
+            for threads in (False, True):
+                seconds = best(lambda: list(console_parallel.imap(function, items, workers=count, threads=threads)),
+                               args.repeat)
+                rates.append(args.items / seconds)
+            print '  {:>8d}{:>20s}{:>20s}'.format(count, *['{:.0f} ({:.2f}x)'.format(rate, rate / serial) for rate in rates])
+            sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# benchmarks the console's boot path, from launching the interpreter to the console exiting
+#  at the first prompt, against synthetic custom function files of different sizes
+# each run copies the console into a temporary install directory, so nothing in the
+#  real install (history, logs, compiled files) is touched
+# "cold" runs start with no compiled files or startup cache in the install directory, "warm" runs reuse
+#  whatever the previous launch left behind
+# usage: python benchmarks/bench_startup.py [--sizes 10 100 1000] [--repeat 5]
+import os, sys
+import time
+import shutil, tempfile, subprocess, argparse
+
+repo_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir, os.pardir))
+console_files = ('python_console.py', 'console_lib_tools.py', 'console_cache.py', 'console_log.py', 'console_shell.py',
+                 'console_completion.py', 'console_history.py', 'console_session_log.py', 'console_jobs.py',
+                 'console_server.py', 'console_client.py', 'console_reload.py',
+                 'console_snapshot.py', 'console_memory.py', 'console_parallel.py',
+                 'console_async.py', 'default_functions.py')
+
+# modules that are cheap to import, used so the benchmark measures the registration
+#  machinery rather than whichever third party modules happen to be installed
+synthetic_mods = ('json', 'decimal', 'fractions', 'collections', 'itertools', 'string', 'textwrap', 'csv')
+
+# returns the source of a custom function file with the given number of registrations
+# registrations are split evenly between functions, commands, variables and modules
+def synthetic_functions(size):
+    lines = ['import __builtin__',
+             "assert hasattr(__builtin__, 'console_lib_tools'), 'No console tools found'",
+             'for tool in __builtin__.console_lib_tools:',
+             '    vars()[tool] = __builtin__.console_lib_tools[tool]',
+             '']
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            lines.append("@register_function('Synthetic function {:d}.')".format(i))
+            lines.append('def synthetic_function_{:d}(x):'.format(i))
+            lines.append('    return x + {:d}'.format(i))
+        elif kind == 1:
+            lines.append("@register_command('synthetic_command_{:d}', description='Synthetic command {:d}.')".format(i, i))
+            lines.append('def synthetic_command_{:d}(*args):'.format(i))
+            lines.append('    return args')
+        elif kind == 2:
+            lines.append('register_variables(synthetic_variable_{:d}={:d})'.format(i, i))
+        else:
+            mod = synthetic_mods[i % len(synthetic_mods)]
+            lines.append("register_modules({:s}='synthetic_module_{:d}')".format(mod, i))
+    return '\n'.join(lines) + '\n'
+
+# removes compiled files and the startup cache left in the install directory by previous launches
+def clear_compiled(install_dir):
+    for root, dirs, files in os.walk(install_dir):
+        for f in files:
+            if f.endswith('.pyc') or f.endswith('.pyo') or f == 'startup_cache':
+                os.remove(os.path.join(root, f))
+
+# launches the console once with empty input and returns the wall time in seconds
+def launch(python, install_dir, work_dir):
+    start = time.time()
+    with open(os.devnull) as devnull_in:
+        with open(os.devnull, 'w') as devnull_out:
+            subprocess.check_call([python, os.path.join(install_dir, 'python_console.py'),
+                                   '--log', os.path.join(work_dir, 'bench.log')],
+                                  stdin=devnull_in, stdout=devnull_out, stderr=devnull_out, cwd=work_dir)
+    return time.time() - start
+
+def summary(times):
+    times = sorted(times)
+    return '{:>9.4f}{:>9.4f}{:>9.4f}'.format(times[0], times[len(times) // 2], times[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks cold and warm startup of the console.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Numbers of registrations in the synthetic function file.')
+    parser.add_argument('--repeat', type=int, default=5, help='Launches per measurement.')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter used to run the console.')
+    args = parser.parse_args()
+
+    print '{:<8s}{:<6s}{:>9s}{:>9s}{:>9s}'.format('size', 'mode', 'min', 'median', 'max')
+    for size in args.sizes:
+        install_dir = tempfile.mkdtemp(prefix='pycon_bench_')
+        work_dir = tempfile.mkdtemp(prefix='pycon_bench_cwd_')
+        try:
+            for f in console_files:
+                shutil.copy(os.path.join(repo_dir, f), install_dir)
+            with open(os.path.join(install_dir, 'custom_functions.py'), 'w') as f:
+                f.write(synthetic_functions(size))
+            cold = []
+            for _ in range(args.repeat):
+                clear_compiled(install_dir)
+                cold.append(launch(args.python, install_dir, work_dir))
+            launch(args.python, install_dir, work_dir)
+            warm = [launch(args.python, install_dir, work_dir) for _ in range(args.repeat)]
+            print '{:<8d}{:<6s}{:s}'.format(size, 'cold', summary(cold))
+            print '{:<8d}{:<6s}{:s}'.format(size, 'warm', summary(warm))
+            sys.stdout.flush()
+        finally:
+            shutil.rmtree(install_dir)
+            shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,515 @@
+# event loop that runs on a thread of its own for the whole session, for the "await" command
+#  and tasks that keep running between prompts
+# python 2 has neither asyncio nor async and await, so coroutines are generators, in the
+#  style of trollius and tornado: a coroutine yields whatever it's waiting for and gets its
+#  result back as the value of the yield (or has its exception raised there), and returns a
+#  value with "raise Return(value)" (or "raise StopIteration(value)"). a coroutine can wait
+#  for a Future (including a Task), another coroutine, a list or tuple of them (for all of
+#  their results), None (to let other tasks run), or anything with add_done_callback() and
+#  result() methods, like the futures of the futures backport, tornado or trollius
+# the loop starts with the first task, and waits with select() on a pipe that other threads
+#  write to when they hand it work, so it wakes up straight away. it can also wait for file
+#  descriptors, for coroutines that talk to sockets
+# each task runs with its own output (see Event_Loop), so what it prints can be told apart
+#  from what the console prints, and tasks that weren't awaited are reported when they finish
+import os, sys
+import time, errno, fcntl, heapq, select, itertools, threading, traceback, types
+from collections import OrderedDict, deque
+
+# raised in a coroutine to return a value
+class Return(Exception):
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+# raised in a coroutine when its task is cancelled
+class CancelledError(Exception):
+    pass
+
+class Future():
+    def __init__(self, loop):
+        self.loop = loop
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        # (type, value, traceback) of the exception it finished with, if any
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancelled(self):
+        return self._error is not None and issubclass(self._error[0], CancelledError)
+
+    def result(self):
+        if not self._done.is_set():
+            raise RuntimeError("The future hasn't finished yet.")
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+    def exception(self):
+        if not self._done.is_set():
+            raise RuntimeError("The future hasn't finished yet.")
+        return self._error[1] if self._error is not None else None
+
+    # both can be called from any thread
+    def set_result(self, value):
+        return self._finish(value, None)
+
+    def set_exception(self, error):
+        if isinstance(error, BaseException):
+            error = (type(error), error, None)
+        return self._finish(None, error)
+
+    def cancel(self):
+        return self._finish(None, (CancelledError, CancelledError(), None))
+
+    # returns False if it had already finished
+    def _finish(self, result, error):
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._result = result
+            self._error = error
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = None
+        for callback in callbacks:
+            self.loop.call_soon(callback, self)
+        return True
+
+    # callback is called with the future on the loop's thread once it's finished
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self.loop.call_soon(callback, self)
+
+    # waits for it to finish, from a thread other than the loop's, and returns whether it has
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+# a coroutine running on the loop
+class Task(Future):
+    def __init__(self, loop, coroutine, source, output):
+        Future.__init__(self, loop)
+        self.coroutine = coroutine
+        self.source = source
+        # where what it prints goes, or None for wherever the console's output goes
+        self.output = output
+        # set by the loop for the tasks it lists
+        self.id = None
+        # whether a statement is waiting for it, in which case it isn't reported when it finishes
+        self.awaited = False
+        self.reported = False
+        self.started = time.time()
+        self.finished = None
+        # the future it's waiting for
+        self.waiting = None
+
+    def start(self):
+        self.loop.call_soon(self._step)
+
+    def status(self):
+        if not self.done():
+            return 'running'
+        if self._error is None:
+            return 'done'
+        return 'cancelled' if self.cancelled() else 'failed'
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    # the exception it failed with, formatted, or None
+    def error(self):
+        if self._error is None or self.cancelled():
+            return None
+        return ''.join(traceback.format_exception(*self._error))
+
+    # raises CancelledError in the coroutine where it's waiting, which it can catch
+    def cancel(self):
+        if self.done():
+            return False
+        self.loop.call_soon(self._cancel)
+        return True
+
+    def _cancel(self):
+        if self.done():
+            return
+        waiting = self.waiting
+        self.waiting = None
+        if waiting is not None:
+            waiting.cancel()
+        self._step(error=(CancelledError, CancelledError(), None))
+
+    def _finish(self, result, error):
+        if not Future._finish(self, result, error):
+            return False
+        self.finished = time.time()
+        if self.id is not None:
+            self.loop.finished.append(self)
+        return True
+
+    def _wake(self, future):
+        if future is not self.waiting:
+            return
+        self.waiting = None
+        self._step(future._result, future._error)
+
+    def _step(self, value=None, error=None):
+        if self.done():
+            return
+        local = self.loop.local
+        if local is not None:
+            local.job = self if self.output is not None else None
+        self.loop.current = self
+        try:
+            if error is not None:
+                yielded = self.coroutine.throw(*error)
+            else:
+                yielded = self.coroutine.send(value)
+        except Return as e:
+            self._finish(e.value, None)
+        except StopIteration as e:
+            self._finish(e.args[0] if e.args else None, None)
+        except BaseException:
+            # including SystemExit, which only ends the task, since there's no one on the
+            #  loop's thread to exit
+            etype, value, tb = sys.exc_info()
+            # leaves out this function's own frame
+            self._finish(None, (etype, value, tb.tb_next or tb))
+        else:
+            try:
+                future = self.loop.wrap(yielded)
+            except TypeError:
+                self.loop.call_soon(self._step, None, sys.exc_info())
+            else:
+                self.waiting = future
+                future.add_done_callback(self._wake)
+        finally:
+            self.loop.current = None
+            if local is not None:
+                local.job = None
+
+class Event_Loop():
+    Return = Return
+    CancelledError = CancelledError
+
+    # local is a threading.local whose job attribute is set to the running task while it
+    #  runs (see console_jobs.Thread_Router), so what it prints is written to task.output
+    # output is called with each task the loop lists to make its output, or None
+    def __init__(self, local=None, output=None):
+        self.local = local
+        self.output = output
+        self.ready = deque()
+        # (when, sequence, callback, args) heap
+        self.timers = []
+        self.sequence = itertools.count()
+        # file descriptor: futures waiting for it to be readable or writable
+        self.readers = {}
+        self.writers = {}
+        self.tasks = OrderedDict()
+        # listed tasks that have finished since the last call to take_finished()
+        self.finished = deque()
+        self.next_id = 1
+        self.current = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.wake_read = self.wake_write = None
+        self.stopping = False
+
+    # starts the loop's thread, or starts it again in a process forked from the console,
+    #  which doesn't have it, or if it has died
+    def _running(self):
+        return self.pid == os.getpid() and (self.stopping or self.thread.is_alive())
+
+    def _ensure_running(self):
+        if self._running():
+            return
+        with self.lock:
+            if self._running():
+                return
+            if self.pid != os.getpid():
+                self.wake_read, self.wake_write = os.pipe()
+                for fd in (self.wake_read, self.wake_write):
+                    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self.thread = threading.Thread(target=self._run, name='event loop')
+            self.thread.daemon = True
+            self.thread.start()
+            self.pid = os.getpid()
+
+    # calls callback(*args) on the loop's thread as soon as it can, from any thread
+    def call_soon(self, callback, *args):
+        self._ensure_running()
+        self.ready.append((callback, args))
+        if threading.current_thread() is not self.thread:
+            self._wake()
+
+    def call_later(self, delay, callback, *args):
+        self._ensure_running()
+        with self.lock:
+            heapq.heappush(self.timers, (time.time() + delay, next(self.sequence), callback, args))
+        if threading.current_thread() is not self.thread:
+            self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self.wake_write, '\0')
+        except OSError as e:
+            # the pipe is full, so the loop is already due to wake up
+            if e.errno != errno.EAGAIN:
+                raise
+
+    # stops the loop's thread, leaving any tasks where they are, so it isn't running while
+    #  the interpreter shuts down
+    def stop(self):
+        if self.pid != os.getpid():
+            return
+        self.stopping = True
+        self._wake()
+        self.thread.join(1.0)
+
+    # an error is reported and the loop carries on, since every later task would hang if
+    #  its thread died
+    def _run(self):
+        while not self.stopping:
+            try:
+                self._run_once()
+            except BaseException:
+                sys.__stderr__.write('Error in the event loop:\n' + traceback.format_exc())
+
+    def _run_once(self):
+        with self.lock:
+            timeout = max(0, self.timers[0][0] - time.time()) if self.timers else None
+        if self.ready:
+            timeout = 0
+        readers = list(self.readers) + [self.wake_read]
+        try:
+            readable, writable = select.select(readers, list(self.writers), [], timeout)[:2]
+        except select.error as e:
+            if e.args[0] == errno.EBADF:
+                self._drop_closed()
+            elif e.args[0] != errno.EINTR:
+                raise
+            return
+        if self.wake_read in readable:
+            try:
+                os.read(self.wake_read, 65536)
+            except OSError:
+                pass
+        for fd in readable:
+            for future in self.readers.pop(fd, ()):
+                future.set_result(fd)
+        for fd in writable:
+            for future in self.writers.pop(fd, ()):
+                future.set_result(fd)
+        now = time.time()
+        with self.lock:
+            while self.timers and self.timers[0][0] <= now:
+                callback, args = heapq.heappop(self.timers)[2:]
+                self.ready.append((callback, args))
+        # only the callbacks that were ready before these run, so a task that keeps
+        #  yielding None can't keep the loop from its timers and file descriptors
+        for _ in range(len(self.ready)):
+            callback, args = self.ready.popleft()
+            try:
+                callback(*args)
+            except BaseException:
+                sys.__stderr__.write('Error in the event loop:\n' + traceback.format_exc())
+
+    # fails the futures waiting for file descriptors that have been closed, and stops
+    #  waiting for them
+    def _drop_closed(self):
+        for table in (self.readers, self.writers):
+            for fd in list(table):
+                try:
+                    os.fstat(fd)
+                except OSError as e:
+                    for future in table.pop(fd):
+                        future.set_exception(e)
+
+    # returns a future for what a coroutine yielded
+    def wrap(self, awaitable):
+        if isinstance(awaitable, Future):
+            return awaitable
+        if isinstance(awaitable, types.GeneratorType):
+            # runs as part of the task that's waiting for it
+            task = Task(self, awaitable, _describe(awaitable), self.current.output if self.current is not None else None)
+            task.start()
+            return task
+        if isinstance(awaitable, (list, tuple)):
+            return self.gather(*awaitable)
+        if awaitable is None:
+            future = Future(self)
+            future.set_result(None)
+            return future
+        if hasattr(awaitable, 'add_done_callback') and hasattr(awaitable, 'result'):
+            future = Future(self)
+            def transfer(other):
+                try:
+                    future.set_result(other.result())
+                except Exception:
+                    future.set_exception(sys.exc_info())
+            awaitable.add_done_callback(transfer)
+            return future
+        raise TypeError('A coroutine can wait for a future, a task, a coroutine, a list or tuple of them, or None, '
+                        'not {:s}.'.format(type(awaitable).__name__))
+
+    # starts a coroutine as a task that's listed by the tasks command, from any thread
+    # source describes it, and defaults to the name of the coroutine's function
+    # awaited is whether a statement is waiting for it, in which case what it prints is
+    #  the statement's output, and it isn't reported when it finishes
+    def create_task(self, coroutine, source=None, awaited=False):
+        if not isinstance(coroutine, types.GeneratorType):
+            raise TypeError('A task runs a coroutine, which is a generator, not {:s}.'.format(type(coroutine).__name__))
+        task = Task(self, coroutine, source or _describe(coroutine), None)
+        task.awaited = awaited
+        with self.lock:
+            task.id = self.next_id
+            self.next_id += 1
+            self.tasks[task.id] = task
+        if self.output is not None and not awaited:
+            task.output = self.output(task)
+        task.start()
+        return task
+
+    # returns a future for the results of all of awaitables, in order, which fails as soon as
+    #  any of them does
+    def gather(self, *awaitables):
+        future = Future(self)
+        futures = [self.wrap(awaitable) for awaitable in awaitables]
+        if not futures:
+            future.set_result([])
+        remaining = [len(futures)]
+        def finished(other):
+            if other._error is not None:
+                future.set_exception(other._error)
+                return
+            remaining[0] -= 1
+            if not remaining[0]:
+                future.set_result([each._result for each in futures])
+        for each in futures:
+            each.add_done_callback(finished)
+        return future
+
+    # returns a future that finishes with result after seconds
+    def sleep(self, seconds, result=None):
+        future = Future(self)
+        self.call_later(seconds, future.set_result, result)
+        return future
+
+    # returns a future for function(*args, **kwargs) run on a new thread, for blocking calls
+    def run_in_thread(self, function, *args, **kwargs):
+        future = Future(self)
+        def run():
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+        thread = threading.Thread(target=run, name='event loop call')
+        thread.daemon = True
+        thread.start()
+        return future
+
+    # return futures that finish with the file descriptor once it's readable or writable
+    # fd can be a file descriptor or anything with a fileno() method, like a socket
+    def readable(self, fd):
+        return self._wait_for_fd(self.readers, fd)
+
+    def writable(self, fd):
+        return self._wait_for_fd(self.writers, fd)
+
+    # the future stops waiting once it's finished some other way, like its task being
+    #  cancelled, so a coroutine can close the file descriptor as it cleans up
+    def _wait_for_fd(self, table, fd):
+        if not isinstance(fd, (int, long)):
+            fd = fd.fileno()
+        future = Future(self)
+        def add():
+            if not future.done():
+                table.setdefault(fd, []).append(future)
+        def remove(future):
+            futures = table.get(fd, ())
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    del table[fd]
+        self.call_soon(add)
+        future.add_done_callback(remove)
+        return future
+
+    # waits for a future from a thread other than the loop's, like the console's, and returns
+    #  its result
+    # the future writes to a pipe when it finishes, and the wait is a select() on it, which
+    #  wakes up as soon as it's written and can be interrupted, unlike a wait on a lock (and
+    #  a lock's wait with a timeout only checks every few milliseconds)
+    # a Ctrl-C cancels it, and waits up to cancel_timeout seconds for the cancellation to
+    #  land, so what the coroutine does as it cleans up happens before the prompt is back
+    def wait(self, future, cancel_timeout=0.5):
+        read, write = os.pipe()
+        lock = threading.Lock()
+        # the write end, until the wait is over. the callback may run after that, and it
+        #  mustn't write to whatever file has since been given the same descriptor
+        pipe = [write]
+        def notify(future):
+            with lock:
+                if pipe:
+                    os.write(pipe[0], '\0')
+        try:
+            future.add_done_callback(notify)
+            self._select_until_done(read, future, None)
+        except KeyboardInterrupt:
+            future.cancel()
+            try:
+                self._select_until_done(read, future, time.time() + cancel_timeout)
+            except KeyboardInterrupt:
+                pass
+            raise
+        finally:
+            with lock:
+                del pipe[:]
+                os.close(write)
+            os.close(read)
+        return future.result()
+
+    # waits on the pipe until future is done, or until the deadline if there is one
+    def _select_until_done(self, read, future, deadline):
+        while not future.done():
+            timeout = 1.0
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return
+            try:
+                select.select([read], [], [], timeout)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    # returns the listed tasks that have finished since the last call
+    def take_finished(self):
+        tasks = []
+        try:
+            while True:
+                tasks.append(self.finished.popleft())
+        except IndexError:
+            pass
+        return tasks
+
+    def get(self, id):
+        try:
+            return self.tasks[id]
+        except KeyError:
+            raise KeyError('No task with id {:d}.'.format(id))
+
+def _describe(coroutine):
+    return '{:s}()'.format(getattr(coroutine, '__name__', 'coroutine'))
+
+# the coroutine behind a statement that awaits something that isn't a coroutine itself
+def await_value(awaitable):
+    result = yield awaitable
+    raise Return(result)
@@ -0,0 +1,125 @@
+# on-disk cache of the work done on every launch before the first prompt
+# stores two things, both in a single marshal file in the install directory:
+#  the project root found for each working directory, along with the modification
+#   times of every directory between the two. creating or removing a .git entry in any
+#   of them changes that directory's mtime, so a cached root is only reused while none
+#   of them have changed. this replaces running "git rev-parse --show-toplevel"
+#  the compiled code of each function file, keyed by path and stored along with the
+#   file's mtime and size, so a file is only recompiled after it changes
+# the cache is rewritten only when something in it changed, and is replaced atomically
+#  so concurrent launches never see a partial file
+# each part keeps at most a fixed number of entries, dropping the ones added or updated
+#  longest ago, so running pycon from many directories doesn't grow the file without limit.
+#  using an entry doesn't move it, since that would mean rewriting the file on every launch
+import os, sys
+import imp, marshal
+from collections import OrderedDict
+
+class Startup_Cache():
+    def __init__(self, path, max_roots=256, max_code=64):
+        self.path = path
+        self.max_roots = max_roots
+        self.max_code = max_code
+        self.dirty = False
+        self.roots = OrderedDict()
+        self.code = OrderedDict()
+        try:
+            with open(path, 'rb') as f:
+                magic, roots, code = marshal.load(f)
+            # compiled code can't be shared between versions of the interpreter
+            if magic == imp.get_magic():
+                # marshal has no ordered dict, so each part is stored as a list of pairs
+                self.roots, self.code = OrderedDict(roots), OrderedDict(code)
+        except Exception:
+            # a missing, stale or corrupt cache is the same as an empty one
+            self.roots, self.code = OrderedDict(), OrderedDict()
+
+    # adds or replaces an entry at the end of table, dropping the oldest past limit
+    def _store(self, table, limit, key, value):
+        table.pop(key, None)
+        table[key] = value
+        while len(table) > limit:
+            table.popitem(last=False)
+        self.dirty = True
+
+    # returns the mtime of each directory from path up to stop (inclusive), or the root
+    #  of the filesystem if stop is None
+    @staticmethod
+    def _dir_mtimes(path, stop):
+        mtimes = []
+        while True:
+            mtimes.append((path, os.stat(path).st_mtime))
+            parent = os.path.dirname(path)
+            if path == stop or parent == path:
+                return mtimes
+            path = parent
+
+    # returns the root of the git project containing cwd, or None if there isn't one
+    # like git, a .git entry can be a directory or a file (for worktrees and submodules)
+    def project_root(self, cwd):
+        cwd = os.path.abspath(cwd)
+        cached = self.roots.get(cwd)
+        if cached is not None:
+            root, mtimes = cached
+            try:
+                if self._dir_mtimes(cwd, root) == mtimes:
+                    return root
+            except OSError:
+                pass
+        root = None
+        path = cwd
+        while True:
+            if os.path.exists(os.path.join(path, '.git')):
+                root = path
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        self._store(self.roots, self.max_roots, cwd, (root, self._dir_mtimes(cwd, root)))
+        return root
+
+    # returns the compiled code of the python file at path, compiling it only if it has
+    #  changed since it was cached
+    # raises IOError if the file doesn't exist, as imp.load_source would
+    def compiled(self, path):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+        cached = self.code.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return marshal.loads(cached[2])
+        with open(path, 'rU') as f:
+            source = f.read()
+        code = compile(source, path, 'exec')
+        self._store(self.code, self.max_code, path, (stat.st_mtime, stat.st_size, marshal.dumps(code)))
+        return code
+
+    # executes the python file at path as a module called name, like imp.load_source
+    #  but without recompiling it or writing a .pyc file next to it
+    def load_source(self, name, path):
+        code = self.compiled(path)
+        module = imp.new_module(name)
+        module.__file__ = os.path.abspath(path)
+        sys.modules[name] = module
+        exec code in module.__dict__
+        return module
+
+    # writes the cache back to disk if it changed
+    def save(self):
+        if not self.dirty:
+            return
+        temp_path = '{:s}.{:d}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                marshal.dump((imp.get_magic(), self.roots.items(), self.code.items()), f)
+            os.rename(temp_path, self.path)
+            self.dirty = False
+        except (IOError, OSError):
+            # the cache is only an optimization, so failing to write it isn't an error
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# thin client for the console server in console_server.py, run by the pycon command
+# connects to the server's socket and sends it the arguments, working directory, environment
+#  and terminal size, then relays between this terminal and the session's pseudo-terminal
+#  until the session exits. it only uses a few standard modules, so run with "python -S" it
+#  starts in a fraction of the time the console itself takes to load
+# the console is run directly instead if there's no server, if input or output isn't a
+#  terminal, or if the server's copy of the console is out of date
+# the messages both ways are a type and a length (see _header), followed by the message:
+#  'h' (hello, the marshalled session details) or 's' (stop the server) from the client,
+#  answered by 'r' (ready) or 'f' (run the console directly) from the server
+#  'd' (data for the terminal) both ways, and 'w' (the terminal's new size) from the client
+#  'x' (exit status) from the server when the session has exited
+import os, sys
+import tty, errno, fcntl, select, signal, socket, struct, marshal, termios
+
+file_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir))
+socket_path = os.path.join(file_dir, 'server.sock')
+
+_header = struct.Struct('!cI')
+_window_size = struct.Struct('HHHH')
+
+def send(sock, kind, payload=''):
+    sock.sendall(_header.pack(kind, len(payload)) + payload)
+
+# splits the messages out of what's read from a socket
+class Message_Reader():
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ''
+        self.messages = []
+
+    # reads once from the socket and returns the messages completed so far
+    # raises EOFError once the other end has closed the connection
+    def read(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise EOFError
+        self.buffer += data
+        while len(self.buffer) >= _header.size:
+            kind, length = _header.unpack_from(self.buffer)
+            end = _header.size + length
+            if len(self.buffer) < end:
+                break
+            self.messages.append((kind, self.buffer[_header.size:end]))
+            self.buffer = self.buffer[end:]
+        messages, self.messages = self.messages, []
+        return messages
+
+    # returns the next message, waiting for it if it hasn't arrived
+    def next(self):
+        while not self.messages:
+            self.messages = self.read()
+        return self.messages.pop(0)
+
+def window_size(fd):
+    return _window_size.unpack(fcntl.ioctl(fd, termios.TIOCGWINSZ, _window_size.pack(0, 0, 0, 0)))
+
+# returns a socket connected to the server, or None if there isn't one
+def connect():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+# replaces this process with the console
+def run_directly(argv):
+    console = os.path.join(file_dir, 'python_console.py')
+    os.execv(sys.executable, [sys.executable, console] + argv)
+
+def _write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+# relays between this terminal and the session until it exits, and returns its exit status
+def _relay(sock, reader):
+    resized = []
+    signal.signal(signal.SIGWINCH, lambda signum, frame: resized.append(True))
+    while True:
+        if resized:
+            del resized[:]
+            send(sock, 'w', _window_size.pack(*window_size(0)))
+        try:
+            ready = select.select([0, sock], [], [])[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        if 0 in ready:
+            data = os.read(0, 65536)
+            if not data:
+                return 0
+            send(sock, 'd', data)
+        if sock in ready:
+            try:
+                messages = reader.read()
+            except EOFError:
+                return 1
+            for kind, payload in messages:
+                if kind == 'd':
+                    _write_all(1, payload)
+                elif kind == 'x':
+                    return int(payload)
+
+# runs a session on the server, and returns its exit status, or None if the server said to
+#  run the console directly
+def run_session(sock, argv):
+    reader = Message_Reader(sock)
+    hello = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ), 'size': window_size(0)}
+    send(sock, 'h', marshal.dumps(hello))
+    kind, payload = reader.next()
+    if kind != 'r':
+        return None
+    attributes = termios.tcgetattr(0)
+    tty.setraw(0)
+    try:
+        return _relay(sock, reader)
+    finally:
+        termios.tcsetattr(0, termios.TCSAFLUSH, attributes)
+
+# asks the server to stop, and returns whether there was one
+def stop_server():
+    sock = connect()
+    if sock is None:
+        return False
+    try:
+        send(sock, 's')
+        Message_Reader(sock).next()
+    except (EOFError, socket.error):
+        pass
+    sock.close()
+    return True
+
+def main(argv):
+    if '--stop_server' in argv:
+        if stop_server():
+            print 'Stopped the console server.'
+        else:
+            print 'No console server is running.'
+        return 0
+    if '--server' in argv or not (os.isatty(0) and os.isatty(1)):
+        run_directly(argv)
+    sock = connect()
+    if sock is None:
+        run_directly(argv)
+    try:
+        status = run_session(sock, argv)
+    except (EOFError, socket.error):
+        # the server went away before the session started
+        status = None
+    sock.close()
+    if status is None:
+        run_directly(argv)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,229 @@
+# tab completion for the console
+# names are kept in sorted lists, so finding the completions of a prefix is a binary search
+#  instead of a scan of the whole namespace. the console's namespace is indexed once and
+#  then kept up to date from the names each statement used (see note_code()), with a full
+#  rescan only when the number of names doesn't add up
+# completes:
+#  special commands, along with names, at the start of a line
+#  the arguments of special commands registered with completion='path' or 'help', and
+#   everything after "%", as file paths or help entries
+#  attributes, as "<expression>.<attribute>", from a cache of each object's dir()
+#  anything else as names in the namespace, builtins and keywords
+import os
+import re, glob, types, bisect, keyword, weakref, __builtin__
+import readline
+from collections import OrderedDict
+
+_attribute_expression = re.compile(r'(\w+(\.\w+)*)\.(\w*)$')
+
+# returns the entries of a sorted list that start with prefix
+def _prefixed(names, prefix):
+    matches = []
+    index = bisect.bisect_left(names, prefix)
+    while index < len(names) and names[index].startswith(prefix):
+        matches.append(names[index])
+        index += 1
+    return matches
+
+# set in the flags of classes that aren't built in, whose attributes can change
+_heap_type = 1 << 9
+
+# returns the classes that cls gets attributes from, in order, for new and old-style classes
+def _classes(cls):
+    if isinstance(cls, type):
+        return cls.__mro__
+    classes = [cls]
+    for base in getattr(cls, '__bases__', ()):
+        classes.extend(_classes(base))
+    return classes
+
+# returns the classes that cls gets attributes from that can gain or lose attributes
+def _mutable_classes(cls):
+    return [klass for klass in _classes(cls) if not isinstance(klass, type) or klass.__flags__ & _heap_type]
+
+# returns the attribute names of the classes that obj's dir() includes, which change when
+#  one of them gains or loses an attribute. for a class, these are its own and its bases'
+def _class_signature(obj):
+    if not isinstance(obj, (type, types.ClassType)):
+        obj = getattr(obj, '__class__', type(obj))
+    return tuple(frozenset(klass.__dict__) for klass in _mutable_classes(obj))
+
+# returns whether obj's type computes its attributes in python
+def _computed_attributes(obj):
+    for klass in _mutable_classes(getattr(obj, '__class__', type(obj))):
+        for name in ('__dir__', '__getattr__', '__getattribute__'):
+            if name in klass.__dict__:
+                return True
+    return False
+
+class Completer():
+    def __init__(self, namespace, special_commands, help_info, dir_cache_size=128):
+        self.namespace = namespace
+        self.special_commands = special_commands
+        self.help_info = help_info
+        self.static_names = sorted(set(dir(__builtin__)) | set(keyword.kwlist))
+        self.names = sorted(namespace)
+        self.pending = set()
+        self.dir_cache = OrderedDict()
+        self.dir_cache_size = dir_cache_size
+        self.matches = []
+        self.update_commands()
+
+    # rebuilds the index of special commands and help entries
+    # needs to be called whenever special_commands or the help entries change
+    def update_commands(self):
+        self.commands = sorted(self.special_commands)
+        self.help_names = sorted(self.help_info)
+
+    # drops everything cached, for when the namespace, the special commands or the help
+    #  entries have changed wholesale
+    def invalidate(self):
+        self.names = sorted(self.namespace)
+        self.pending.clear()
+        self.dir_cache.clear()
+        self.update_commands()
+
+    # records the names used by a statement that just ran, since those are the names it
+    #  could have added to or removed from the namespace
+    # the index isn't updated until the next completion, so this is cheap
+    def note_code(self, code):
+        names = getattr(code, 'co_names', None)
+        if names:
+            self.pending.update(names)
+
+    # brings the index of the namespace up to date
+    def _sync(self):
+        for name in self.pending:
+            index = bisect.bisect_left(self.names, name)
+            indexed = index < len(self.names) and self.names[index] == name
+            if name in self.namespace and not indexed:
+                self.names.insert(index, name)
+            elif indexed and name not in self.namespace:
+                del self.names[index]
+        self.pending.clear()
+        # names added or removed some other way, like through globals() or exec
+        if len(self.names) != len(self.namespace):
+            self.names = sorted(self.namespace)
+
+    # the function given to readline.set_completer()
+    def complete(self, text, state):
+        if state == 0:
+            try:
+                self.matches = self._matches(text)
+            except Exception:
+                # an error in a completer is swallowed by readline anyway
+                self.matches = []
+        if state < len(self.matches):
+            return self.matches[state]
+        return None
+
+    def _matches(self, text):
+        line = readline.get_line_buffer()
+        begidx = readline.get_begidx()
+        endidx = readline.get_endidx()
+        stripped = line.lstrip()
+        if stripped.startswith('%'):
+            return self._path_matches(line, begidx, endidx, text)
+        if ' ' in stripped and begidx > len(line) - len(stripped):
+            command = stripped.split(' ', 1)[0]
+            completion = self.special_commands.get(command, {}).get('completion')
+            if completion == 'path':
+                return self._path_matches(line, begidx, endidx, text)
+            if completion == 'help':
+                return _prefixed(self.help_names, text)
+        if '.' in text:
+            return self._attribute_matches(text)
+        self._sync()
+        matches = []
+        if not line[:begidx].strip():
+            matches += _prefixed(self.commands, text)
+        for name in _prefixed(self.names, text) + _prefixed(self.static_names, text):
+            if name in keyword.kwlist:
+                matches.append(name)
+                continue
+            try:
+                value = self.namespace[name]
+            except KeyError:
+                value = getattr(__builtin__, name, None)
+            matches.append(self._callable_postfix(value, name))
+        return sorted(set(matches))
+
+    # completes the whitespace separated word the cursor is in as a file path
+    # readline only replaces text (which stops at characters like '/'), so the part of the
+    #  word before it is cut from each match
+    def _path_matches(self, line, begidx, endidx, text):
+        start = max(line.rfind(' ', 0, endidx), line.rfind('%', 0, endidx)) + 1
+        word = line[start:endidx]
+        matches = []
+        for path in glob.glob(os.path.expanduser(word) + '*'):
+            if os.path.isdir(path):
+                path += '/'
+            if word.startswith('~'):
+                path = '~' + path[len(os.path.expanduser('~')):]
+            matches.append(path[begidx - start:])
+        return sorted(matches)
+
+    def _attribute_matches(self, text):
+        match = _attribute_expression.match(text)
+        if not match:
+            return []
+        expr, attr = match.group(1), match.group(3)
+        try:
+            obj = eval(expr, self.namespace)
+        except Exception:
+            return []
+        words = _prefixed(self._dir(obj), attr)
+        if not attr.startswith('_'):
+            words = [word for word in words if not word.startswith('_')]
+        # checking whether each attribute is callable means looking each one up, which is
+        #  slow on objects with many computed attributes, so it's skipped for long lists
+        if len(words) > 100:
+            return ['{:s}.{:s}'.format(expr, word) for word in words]
+        matches = []
+        for word in words:
+            try:
+                value = getattr(obj, word)
+            except Exception:
+                value = None
+            matches.append(self._callable_postfix(value, '{:s}.{:s}'.format(expr, word)))
+        return matches
+
+    # returns the sorted dir() of obj, from the cache if neither obj nor its classes have
+    #  gained or lost attributes since it was cached
+    # objects without a __dict__, like builtins and instances of classes with __slots__, get
+    #  their attributes from their type, so they share an entry keyed by the type. others,
+    #  including classes, are keyed by id and checked with a weak reference, so the cache
+    #  never keeps an object alive or mistakes a new object for an old one
+    # objects whose attributes are computed, by a __dir__, __getattr__ or __getattribute__
+    #  defined in python (like a DataFrame's columns), aren't cached, since nothing cheap
+    #  shows when those change. dir() is still only called once per completion. neither
+    #  are modules, whose dir() is only the keys of their __dict__, which is as quick to
+    #  list as to check
+    def _dir(self, obj):
+        if isinstance(obj, types.ModuleType) or _computed_attributes(obj):
+            return sorted(set(dir(obj)) | set(['__class__']))
+        attrs = getattr(obj, '__dict__', None)
+        try:
+            keys = frozenset(attrs)
+        except Exception:
+            key, ref, keys = type(obj), None, None
+        else:
+            try:
+                key, ref = id(obj), weakref.ref(obj)
+            except TypeError:
+                return sorted(set(dir(obj)) | set(['__class__']))
+        signature = (keys, _class_signature(obj))
+        entry = self.dir_cache.pop(key, None)
+        if entry is None or (ref is not None and entry[0]() is not obj) or entry[1] != signature:
+            names = set(dir(obj))
+            names.add('__class__')
+            entry = (ref, signature, sorted(names))
+        self.dir_cache[key] = entry
+        if len(self.dir_cache) > self.dir_cache_size:
+            self.dir_cache.popitem(last=False)
+        return entry[2]
+
+    def _callable_postfix(self, value, word):
+        if callable(value):
+            word += '('
+        return word
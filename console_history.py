@@ -0,0 +1,212 @@
+# append-only store for the console's command history
+# each entry is appended to the history file as soon as it's entered, so concurrent
+#  sessions add to the same file instead of overwriting each other's history at exit, and
+#  nothing is lost if a session crashes. the file stays in readline's history format, one
+#  entry per line
+# appends hold a shared lock on <history>.lock, and compaction holds it exclusively while
+#  it rewrites the file, so no session's entries are lost to a compaction in another one
+# only the most recent entries are loaded into readline at startup. search() covers the
+#  whole file, through an index of the words in each entry that's built on the first search
+#  and then extended with whatever any session has appended since
+import os
+import re, bisect, fcntl, tempfile, threading
+from contextlib import contextmanager
+
+# words are split at underscores too, so searching for part of a name like a_unique_name
+#  still finds it
+_word = re.compile(r'[^\W_]+')
+
+class History_Store():
+    def __init__(self, path, size=50000):
+        self.path = path
+        self.size = size
+        self.lock_file = open(path + '.lock', 'a')
+        self.search_lock = threading.Lock()
+        # index of the file as of the last search: the entries read so far, the file's
+        #  identity and how much of it has been read, and the sorted words of every entry
+        #  with the positions of the entries they appear in
+        self.entries = []
+        self.identity = None
+        self.offset = 0
+        self.words = []
+        self.postings = {}
+
+    @contextmanager
+    def _locked(self, operation):
+        fcntl.flock(self.lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    # appends an entry to the history file
+    # the file is opened for each entry, so entries go to the new file after a compaction
+    def append(self, entry):
+        with self._locked(fcntl.LOCK_SH):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            try:
+                os.write(fd, entry + '\n')
+            finally:
+                os.close(fd)
+
+    # returns the last count entries, reading back from the end of the file only as far as
+    #  it needs to
+    def recent(self, count, block_size=65536):
+        if count <= 0:
+            return []
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return []
+        with f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = ''
+            # one more line break than entries, to be sure the first entry is complete
+            while position > 0 and data.count('\n') <= count:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        lines = data.split('\n')
+        if position > 0:
+            lines = lines[1:]
+        return [line for line in lines if line][-count:]
+
+    # compacts the history file from a background thread
+    def compact_in_background(self):
+        thread = threading.Thread(target=self.compact, name='history compaction')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    # rewrites the file with only the last size distinct entries, keeping the most recent
+    #  occurrence of each, once it holds more than twice that many entries
+    # the new file replaces the old one with a rename, so a reader never sees it half written
+    # whether it's needed is checked first without the lock, so other sessions' appends only
+    #  wait for the rewrite itself
+    def compact(self):
+        if not self._over_limit(2 * self.size):
+            return
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                with open(self.path, 'rb') as f:
+                    lines = [line for line in f.read().split('\n') if line]
+            except IOError:
+                return
+            if len(lines) <= 2 * self.size:
+                return
+            seen = set()
+            kept = []
+            for line in reversed(lines):
+                if line not in seen:
+                    seen.add(line)
+                    kept.append(line)
+                    if len(kept) >= self.size:
+                        break
+            kept.reverse()
+            fd, temp_path = tempfile.mkstemp(prefix='.history_', dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(''.join(line + '\n' for line in kept))
+                os.chmod(temp_path, os.stat(self.path).st_mode & 0777)
+                os.rename(temp_path, self.path)
+            except:
+                os.remove(temp_path)
+                raise
+
+    # returns whether the history file holds more than limit entries
+    # every entry takes at least two bytes, so a small file isn't read at all, and a large
+    #  one is only read until it has shown more than limit line breaks
+    def _over_limit(self, limit, block_size=1 << 20):
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return False
+        with f:
+            if os.fstat(f.fileno()).st_size <= 2 * limit:
+                return False
+            lines = 0
+            while lines <= limit:
+                block = f.read(block_size)
+                if not block:
+                    return False
+                lines += block.count('\n')
+        return True
+
+    # brings the index up to date with the history file
+    # if the file has been replaced by a compaction since the last search, it's read again
+    #  from the start, otherwise only what's been appended since is read
+    def _refresh(self):
+        with self._locked(fcntl.LOCK_SH):
+            try:
+                f = open(self.path, 'rb')
+            except IOError:
+                return
+            with f:
+                stat = os.fstat(f.fileno())
+                identity = (stat.st_dev, stat.st_ino)
+                if identity != self.identity or stat.st_size < self.offset:
+                    self.entries = []
+                    self.words = []
+                    self.postings = {}
+                    self.identity = identity
+                    self.offset = 0
+                f.seek(self.offset)
+                data = f.read()
+        # an entry that's still being written is left for the next search
+        data = data[:data.rfind('\n') + 1]
+        self.offset += len(data)
+        new_words = []
+        for line in data.split('\n'):
+            if line:
+                self._index(line, new_words)
+        # sorting the new words onto the end of the sorted list is a single merge
+        if new_words:
+            self.words.extend(new_words)
+            self.words.sort()
+
+    def _index(self, entry, new_words):
+        position = len(self.entries)
+        self.entries.append(entry)
+        for word in set(_word.findall(entry)):
+            if word not in self.postings:
+                new_words.append(word)
+                self.postings[word] = []
+            self.postings[word].append(position)
+
+    # returns the positions of entries with a word that starts with prefix
+    def _prefixed(self, prefix):
+        positions = set()
+        index = bisect.bisect_left(self.words, prefix)
+        while index < len(self.words) and self.words[index].startswith(prefix):
+            positions.update(self.postings[self.words[index]])
+            index += 1
+        return positions
+
+    # returns the most recent limit distinct entries that contain text, oldest first
+    # each word in text narrows the search to the entries with a word starting with it,
+    #  before they're checked for text itself. so text can end partway through a word, but
+    #  not start partway through one
+    def search(self, text='', limit=20):
+        with self.search_lock:
+            self._refresh()
+            candidates = None
+            for prefix in sorted(set(_word.findall(text)), key=len, reverse=True):
+                positions = self._prefixed(prefix)
+                candidates = positions if candidates is None else candidates & positions
+                if not candidates:
+                    return []
+            if candidates is None:
+                candidates = xrange(len(self.entries))
+            matches = []
+            seen = set()
+            for position in sorted(candidates, reverse=True):
+                entry = self.entries[position]
+                if text in entry and entry not in seen:
+                    seen.add(entry)
+                    matches.append(entry)
+                    if len(matches) >= limit:
+                        break
+            matches.reverse()
+            return matches
@@ -0,0 +1,309 @@
+# background jobs for the console
+# a job runs a statement, expression or special command while the console carries on
+# thread jobs run on a pool of threads, in the console's own namespace. the names a
+#  statement assigns are kept aside while it runs and bound into the namespace all at once
+#  when it finishes, and the value of an expression is bound as _job<id>
+# process jobs fork a new process for each job, so they see the namespace as it is when
+#  they're started (a pool of processes started earlier would have an older copy of it).
+#  the names they assign and the value of an expression are pickled back to the console
+#  when they finish. anything that can't be pickled is left out and reported
+# whatever a job prints goes to its own buffer instead of the terminal. for thread jobs,
+#  sys.stdout and sys.stderr are replaced by Thread_Router objects, which send writes from
+#  a job's thread to the job and everything else on to where it would have gone. a process
+#  job's stdout and stderr are a pipe back to the console
+import os, sys
+import imp, time, ctypes, signal, cPickle, threading, traceback
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+
+# shared with default_functions.py, which keeps the console's long-lived shell in it
+console_shell = sys.modules.get('console_shell')
+if console_shell is None:
+    console_shell = imp.load_source('console_shell', os.path.join(os.path.dirname(__file__), 'console_shell.py'))
+
+# formats the exception being handled, leaving out the frames in this module that come
+#  before the job's own, as the console does for its own frames
+def _format_error():
+    etype, value, tb = sys.exc_info()
+    while tb is not None and tb.tb_frame.f_globals.get('__name__') == __name__:
+        tb = tb.tb_next
+    return ''.join(traceback.format_exception(etype, value, tb))
+
+# raised in a thread job's thread to kill it
+class Job_Killed(Exception):
+    pass
+
+class Job():
+    def __init__(self, id, source, kind, output_limit):
+        self.id = id
+        self.source = source
+        self.kind = kind
+        # running, done, failed or killed
+        self.status = 'running'
+        self.output = console_shell.Head_Tail_Buffer(output_limit)
+        self.result = None
+        self.error = None
+        # names bound into the namespace when the job finished, and names that couldn't be
+        #  pickled back from a process job
+        self.bound = []
+        self.skipped = []
+        self.started = time.time()
+        self.finished = None
+        self.done = threading.Event()
+        # whether the console has shown that the job finished
+        self.reported = False
+        self.lock = threading.Lock()
+        # set once the job starts running
+        self.thread_id = None
+        self.pid = None
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+# file-like object that sends writes from a job's thread to the job's output, and
+#  everything else to target
+class Thread_Router():
+    def __init__(self, target, local):
+        self.target = target
+        self.local = local
+
+    def write(self, string):
+        job = getattr(self.local, 'job', None)
+        if job is None:
+            self.target.write(string)
+        else:
+            job.output.write(str(string))
+
+    def writelines(self, sequence):
+        for s in sequence:
+            self.write(s)
+
+    def flush(self):
+        if getattr(self.local, 'job', None) is None:
+            self.target.flush()
+
+    def fileno(self):
+        return self.target.fileno()
+
+    # a job's output is never a terminal
+    def isatty(self):
+        if getattr(self.local, 'job', None) is not None:
+            return False
+        return getattr(self.target, 'isatty', lambda: False)()
+
+class Job_Manager():
+    # namespace is the console's namespace
+    # on_finish is called with each job when it finishes, from the thread that ran it
+    # on_fork is called in a process job's forked process before the job runs, to detach it
+    #  from anything that relies on the console's other threads, like the log writers
+    def __init__(self, namespace, threads=4, output_limit=1048576, on_finish=None, on_fork=None):
+        self.namespace = namespace
+        self.threads = threads
+        self.output_limit = output_limit
+        self.on_finish = on_finish
+        self.on_fork = on_fork
+        self.pool = None
+        self.jobs = OrderedDict()
+        self.local = threading.local()
+        # jobs that have finished since the last call to take_finished()
+        self.finished = deque()
+        self.next_id = 1
+
+    def router(self, target):
+        return Thread_Router(target, self.local)
+
+    # starts a job and returns it
+    # code is a code object, or a function that takes no arguments. expression is whether
+    #  code is an expression to be evaluated. context is the namespace special commands
+    #  run in, or None for a statement, whose names are bound when it finishes
+    def submit(self, source, code, context=None, expression=False, process=False):
+        job = Job(self.next_id, source, 'process' if process else 'thread', self.output_limit)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        if process:
+            self._start_process(job, code, context, expression)
+        else:
+            # the pool's threads are only started by the first thread job
+            if self.pool is None:
+                self.pool = ThreadPool(self.threads)
+            self.pool.apply_async(self._run_thread, (job, code, context, expression))
+        return job
+
+    def get(self, id):
+        try:
+            return self.jobs[id]
+        except KeyError:
+            raise KeyError('No job with id {:d}.'.format(id))
+
+    # returns the jobs that have finished since the last call
+    def take_finished(self):
+        jobs = []
+        try:
+            while True:
+                jobs.append(self.finished.popleft())
+        except IndexError:
+            pass
+        return jobs
+
+    # kills a running job
+    # a thread job is stopped by raising Job_Killed in its thread, which only happens when
+    #  the thread next runs python code, so a thread blocked in a long call (like a sleep
+    #  or a read) is only stopped once the call returns
+    # returns whether the job was still running
+    def kill(self, id):
+        job = self.get(id)
+        with job.lock:
+            if job.status != 'running':
+                return False
+            if job.kind == 'process':
+                if job.pid is not None:
+                    try:
+                        os.killpg(job.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+            elif job.thread_id is not None:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(job.thread_id), ctypes.py_object(Job_Killed))
+            else:
+                # still waiting for a thread
+                job.status = 'killed'
+        return True
+
+    # runs code and returns (result, names), where names are the names a statement assigned
+    def _execute(self, code, context, expression):
+        if callable(code):
+            return code(), {}
+        if expression:
+            return eval(code, self.namespace), {}
+        names = {}
+        exec code in self.namespace, (names if context is None else context)
+        return None, names
+
+    def _run_thread(self, job, code, context, expression):
+        try:
+            with job.lock:
+                if job.status != 'running':
+                    return self._finish(job)
+                job.thread_id = threading.current_thread().ident
+            self.local.job = job
+            try:
+                result, names = self._execute(code, context, expression)
+            except Job_Killed:
+                job.status = 'killed'
+            except:
+                job.status = 'failed'
+                job.error = _format_error()
+            else:
+                job.result = result
+                if expression:
+                    names = {'_job{:d}'.format(job.id): result}
+                self.namespace.update(names)
+                job.bound = sorted(names)
+                job.status = 'done'
+            finally:
+                self.local.job = None
+                with job.lock:
+                    job.thread_id = None
+            self._finish(job)
+        except Job_Killed:
+            # killed just as it finished, after the job's own code had already returned
+            self.local.job = None
+            if not job.done.is_set():
+                self._finish(job)
+
+    def _finish(self, job):
+        job.finished = time.time()
+        self.finished.append(job)
+        job.done.set()
+        if self.on_finish is not None:
+            self.on_finish(job)
+
+    def _start_process(self, job, code, context, expression):
+        out_read, out_write = os.pipe()
+        result_read, result_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # never returns, and never runs the console's exit handlers
+            try:
+                os.close(out_read)
+                os.close(result_read)
+                self._child(job, code, context, expression, out_write, result_write)
+            finally:
+                os._exit(1)
+        os.close(out_write)
+        os.close(result_write)
+        job.pid = pid
+        thread = threading.Thread(target=self._collect_process, name='job {:d}'.format(job.id),
+                                  args=(job, os.fdopen(out_read, 'rb'), os.fdopen(result_read, 'rb')))
+        thread.daemon = True
+        thread.start()
+
+    # runs in the forked process
+    def _child(self, job, code, context, expression, out_write, result_write):
+        # in its own process group, so a Ctrl-C at the console doesn't reach it and kill()
+        #  reaches anything it starts
+        os.setsid()
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGPIPE):
+            signal.signal(signum, signal.SIG_DFL)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.dup2(out_write, 1)
+        os.dup2(out_write, 2)
+        sys.stdout = sys.stderr = os.fdopen(1, 'w', 0)
+        self.local.job = None
+        if self.on_fork is not None:
+            self.on_fork()
+        payload = {'values': {}, 'skipped': [], 'error': None}
+        try:
+            result, names = self._execute(code, context, expression)
+            if expression:
+                names = {'_job{:d}'.format(job.id): result}
+            for name, value in names.items():
+                try:
+                    payload['values'][name] = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    payload['skipped'].append(name)
+        except:
+            payload['error'] = _format_error()
+        data = cPickle.dumps(payload, cPickle.HIGHEST_PROTOCOL)
+        with os.fdopen(result_write, 'wb') as f:
+            f.write(data)
+        sys.stdout.flush()
+        os._exit(0)
+
+    # collects a process job's output and result, then binds its values
+    def _collect_process(self, job, out_file, result_file):
+        data = []
+        try:
+            for name, chunk in console_shell._read_pipes(out_file, result_file):
+                if name == 'out':
+                    job.output.write(chunk)
+                else:
+                    data.append(chunk)
+        finally:
+            out_file.close()
+            result_file.close()
+        status = os.waitpid(job.pid, 0)[1]
+        with job.lock:
+            if os.WIFSIGNALED(status):
+                job.status = 'killed'
+            elif not data:
+                job.status = 'failed'
+                job.error = 'The job exited with status {:d} before it finished.\n'.format(os.WEXITSTATUS(status))
+            else:
+                payload = cPickle.loads(''.join(data))
+                job.skipped = sorted(payload['skipped'])
+                if payload['error']:
+                    job.status = 'failed'
+                    job.error = payload['error']
+                else:
+                    values = {}
+                    for name, value in payload['values'].items():
+                        try:
+                            values[name] = cPickle.loads(value)
+                        except Exception:
+                            job.skipped.append(name)
+                    self.namespace.update(values)
+                    job.bound = sorted(values)
+                    job.result = values.get('_job{:d}'.format(job.id))
+                    job.status = 'done'
+        self._finish(job)
@@ -4,7 +4,7 @@
 #  by default, this is all imported modules and all functions, defined locally or imported
 # these functions execute in the namespace local to this file, so to modify the export_dict
 #  of a special functions file, "export_dict['export_dict']" can be used as a reference
-import importlib
+import importlib, os, sys, time, types
 
 export_dict = {}
 export_dict['export_dict'] = {'~special_commands': {}}
@@ -55,18 +55,22 @@ def register_function(input, detail_dict={}, help=True):
 # invocation is how the interpreter invokes the function
 #  the default, for example, is '<func>({:s})', where <func> is the name of the python function
 #   being invoked, and {:s} will be replaced by the arguments to the command
+# completion is how tab completes the command's arguments: 'path' for file paths, 'help' for
+#  the names that have help entries, or None (the default) for python names and attributes
 @_register_lib_tool
-def register_command(command, invocation=None, description='', detail_dict={}, help=True):
+def register_command(command, invocation=None, description='', detail_dict={}, help=True, completion=None):
     if help:
         _store_help(command, 'special command', description, detail_dict)
     if invocation:
         def registration_decorator(func):
-            export_dict['export_dict']['~special_commands'][command] = {'function': func, 'invocation': invocation}
+            export_dict['export_dict']['~special_commands'][command] = {'function': func, 'invocation': invocation,
+                                                                        'completion': completion}
             return func
         return registration_decorator
     def registration_decorator(func):
         invocation = '{:s}({:s})'.format(func.func_name, '{:s}')
-        export_dict['export_dict']['~special_commands'][command] = {'function': func, 'invocation': invocation}
+        export_dict['export_dict']['~special_commands'][command] = {'function': func, 'invocation': invocation,
+                                                                    'completion': completion}
         return func
     return registration_decorator
 
@@ -79,23 +83,98 @@ def register_variables(**vars):
     for var in vars:
         export_dict['export_dict'][var] = vars[var]
 
+# module object bound in place of a lazily registered module
+# the real module is only imported on the first attribute access, including the dir()
+#  call made by tab completion. attributes are looked up on the real module every time
+#  instead of being copied onto the proxy, so ones the module reassigns later aren't stale
+class Lazy_Module(types.ModuleType):
+    def _load(self):
+        module = self.__dict__.get('__lazy_target__')
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['__lazy_target__'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__.get('__lazy_target__') is None:
+            return "<module '{:s}' (not yet imported)>".format(self.__name__)
+        return repr(self.__dict__['__lazy_target__'])
+
+# whether register_modules() defers imports when it isn't given a "lazy" argument
+_lazy_default = False
+
+# function for changing whether modules are registered lazily by default
+# affects every later call to register_modules() that doesn't pass "lazy" itself,
+#  including the calls made by the other function files, so calling this at the top of
+#  a project's console_lib.py makes all of the default registrations lazy too
+@_register_lib_tool
+def set_lazy_modules(lazy=True):
+    global _lazy_default
+    _lazy_default = lazy
+
+# when set to a list by the console's --profile-startup mode, every call to
+#  register_modules() appends where it was called from and how long each binding took
+_import_timings = None
+
+# returns the module to bind for the given name
+# modules that have already been imported are bound directly, since there's nothing to defer
+def _module_binding(name, lazy):
+    if name in sys.modules and sys.modules[name] is not None:
+        return sys.modules[name]
+    if lazy:
+        return Lazy_Module(name)
+    return importlib.import_module(name)
+
+# calls func with the given arguments, recording how long it took under name in timings
+# timings is None unless startup is being profiled
+def _timed(timings, name, func, *args):
+    if timings is None:
+        return func(*args)
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        timings.append((name, time.time() - start))
+
 # function for registering modules
 # takes any number of arguments as strings of the names of the modules to be registered
 # or keyword arguments such that the argument foo='bar' imports the foo module as bar
 # also optionally takes a dictionary 'partials' of module names to the names of one or
 #  more desired attributes to import, as strings or an iterable of strings
+# if 'lazy' is True, each module is bound as a proxy that imports it on first use
+#  the default is set by set_lazy_modules(). only whole modules are deferred, since a proxy
+#  can't stand in for an attribute like a constant or a class everywhere it's used, so the
+#  modules of partials are always imported immediately
 @_register_lib_tool
 def register_modules(*mods, **renamed_mods):
+    lazy = renamed_mods.pop('lazy', _lazy_default)
+    timings = None
+    if _import_timings is not None:
+        timings = []
+        caller = sys._getframe(1)
+        _import_timings.append(('{:s}:{:d}'.format(os.path.basename(caller.f_code.co_filename), caller.f_lineno), timings))
     for mod in mods:
-        export_dict['export_dict'][mod] = importlib.import_module(mod)
+        export_dict['export_dict'][mod] = _timed(timings, mod, _module_binding, mod, lazy)
     for mod in renamed_mods:
         if mod != 'partials':
-            export_dict['export_dict'][renamed_mods[mod]] = importlib.import_module(mod)
+            export_dict['export_dict'][renamed_mods[mod]] = _timed(timings, mod, _module_binding, mod, lazy)
     partials = renamed_mods.get('partials', {})
     for mod in partials:
-        module = importlib.import_module(mod)
         def import_partial(obj):
             if obj == '*':
+                module = _timed(timings, mod, importlib.import_module, mod)
                 attrs = [attr for attr in module.__all__]
             elif type(obj) == type(''):
                 attrs = [obj]
@@ -106,5 +185,6 @@ def register_modules(*mods, **renamed_mods):
             else:
                 raise TypeError('The desired attributes must be specified as strings or iterables thereof')
             for attr in attrs:
+                module = _timed(timings, mod, importlib.import_module, mod)
                 export_dict['export_dict'][attr] = getattr(module, attr)
         import_partial(partials[mod])
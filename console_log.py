@@ -0,0 +1,210 @@
+# file-like object used for the console's log file
+# writes are appended to a pending buffer that a background thread drains and writes in
+#  batches, so printing to the console only ever waits on the terminal, not on the log.
+#  the thread is woken through a bounded queue once enough has been written, when the
+#  console asks for it at the end of each statement, or after a short interval, which
+#  covers output printed by other threads while the console is waiting for input
+# appending to and draining a deque are both atomic, so writes don't need a lock
+# if the queue is full, writers block until there's room rather than dropping anything
+# the log can optionally be rotated when it reaches a size or age, keeping a number of
+#  older segments as <log>.1, <log>.2 and so on, optionally gzip compressed
+import os, sys
+import time, gzip, shutil, threading, Queue
+from collections import deque
+
+class Log_Writer():
+    def __init__(self, path, background=True, max_bytes=0, interval=0, backups=5, compress=False,
+                 batch_size=65536, flush_interval=0.5, queue_size=64):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backups = backups
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.closed = False
+        self.lock = threading.Lock()
+        self.pending = deque()
+        # only approximate, since it's updated without a lock. it just decides when to
+        #  wake the background thread
+        self.pending_size = 0
+        self._open()
+        self.queue = None
+        if background:
+            self.queue = Queue.Queue(queue_size)
+            self.thread = threading.Thread(target=self._run, name='log writer')
+            # the thread is stopped by close(), which the console registers with atexit
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _open(self):
+        self.file = open(self.path, 'a')
+        self.size = self.file.tell()
+        self.opened = time.time()
+
+    def write(self, string):
+        if self.closed:
+            return
+        if self.queue is None:
+            with self.lock:
+                self._write(string)
+            return
+        self.pending.append(string)
+        self.pending_size += len(string)
+        if self.pending_size >= self.batch_size:
+            self.submit()
+
+    def writelines(self, sequence):
+        for s in sequence:
+            self.write(s)
+
+    # wakes the background thread to write whatever has been written so far, without
+    #  waiting for it to be written
+    def submit(self):
+        if self.queue is None or self.closed or not self.pending:
+            return
+        self.pending_size = 0
+        self.queue.put(None)
+
+    # blocks until everything written so far is in the log file
+    def flush(self):
+        self._control('flush')
+
+    # empties the log, after anything written before this call has been written
+    def clear(self):
+        self._control('clear')
+
+    # writes everything still pending, then stops the background thread and closes the log
+    # safe to call more than once
+    def close(self):
+        if self.closed:
+            return
+        self._control('close')
+        self.closed = True
+        if self.queue is not None:
+            self.thread.join()
+
+    # called in a forked process, which has copies of the writer's state but not its thread
+    # later writes are dropped instead of being queued for a thread that isn't there, and
+    #  the lock is replaced, since the fork may have happened while another thread held it
+    def detach(self):
+        self.closed = True
+        self.lock = threading.Lock()
+
+    # takes everything pending as a single string
+    def _take(self):
+        parts = []
+        try:
+            while True:
+                parts.append(self.pending.popleft())
+        except IndexError:
+            pass
+        return ''.join(parts)
+
+    # runs a control command in order with the writes before it, and waits for it to finish
+    def _control(self, command):
+        if self.closed:
+            return
+        if self.queue is None or not self.thread.is_alive():
+            with self.lock:
+                self._write(self._take())
+                self._command(command)
+            return
+        done = threading.Event()
+        self.queue.put((command, done))
+        done.wait()
+
+    def _command(self, command):
+        if command == 'flush':
+            self.file.flush()
+        elif command == 'clear':
+            self.file.seek(0, 0)
+            self.file.truncate()
+            self.size = 0
+            self.opened = time.time()
+        elif command == 'close':
+            self.file.flush()
+            self.file.close()
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except Queue.Empty:
+                item = None
+            command = done = None
+            if type(item) is tuple:
+                command, done = item
+            try:
+                # control commands act on everything written before them
+                self._write(self._take())
+                if command:
+                    self._command(command)
+                elif self.queue.empty():
+                    self.file.flush()
+            except Exception as e:
+                self._report(e)
+            finally:
+                # the caller is released and a close ends the thread even if writing failed
+                if done:
+                    done.set()
+                if command == 'close':
+                    return
+
+    # writes to the log file, rotating it first if needed
+    # when rotating by size, output is split at the last line break that fits, so a segment
+    #  only ends mid-line if that single line is longer than the limit
+    def _write(self, string):
+        while string:
+            if self.interval and self.size and time.time() - self.opened >= self.interval:
+                self._rotate()
+            if not self.max_bytes or self.size + len(string) <= self.max_bytes:
+                self.file.write(string)
+                self.size += len(string)
+                return
+            room = self.max_bytes - self.size
+            cut = 0
+            if room > 0:
+                cut = string.rfind('\n', 0, room) + 1
+                if not cut and not self.size:
+                    cut = room
+            if cut:
+                self.file.write(string[:cut])
+                self.size += cut
+                string = string[cut:]
+            self._rotate()
+
+    def _segment(self, index):
+        name = '{:s}.{:d}'.format(self.path, index)
+        if self.compress:
+            name += '.gz'
+        return name
+
+    # closes the current log and moves it to <log>.1, shifting older segments back one
+    # with no backups, the current log is just emptied
+    def _rotate(self):
+        self.file.close()
+        try:
+            if self.backups > 0:
+                if os.path.exists(self._segment(self.backups)):
+                    os.remove(self._segment(self.backups))
+                for index in range(self.backups - 1, 0, -1):
+                    if os.path.exists(self._segment(index)):
+                        os.rename(self._segment(index), self._segment(index + 1))
+                if self.compress:
+                    with open(self.path, 'rb') as source:
+                        with gzip.open(self._segment(1), 'wb') as dest:
+                            shutil.copyfileobj(source, dest)
+                    os.remove(self.path)
+                else:
+                    os.rename(self.path, self._segment(1))
+            else:
+                os.remove(self.path)
+        finally:
+            # even if moving the old segment failed, the log has to stay writable
+            self._open()
+
+    # errors in the background thread can't be raised to anyone, so they're printed
+    #  straight to the terminal instead of through the (logged) stderr
+    def _report(self, e):
+        sys.__stderr__.write('Error writing to the log "{:s}": {:s}\n'.format(self.path, str(e)))
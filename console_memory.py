@@ -0,0 +1,154 @@
+# memory measurements for the mem, memdiff and free commands
+# deep sizes count everything reachable from an object through gc.get_referents(), except
+#  modules, classes and functions, which are shared rather than owned. objects reachable
+#  from two names are counted under both
+# walking a large object is slow, so each name's size is cached along with a fingerprint of
+#  its value (its id, length and shallow size), and only recomputed when the fingerprint
+#  changes or a statement has used the name since (see note_code()). a change deep inside a
+#  value that's reached through some other name can be missed, which "mem refresh" fixes
+import os, sys
+import gc, types, resource
+
+# objects that a deep size doesn't descend into
+_shared_types = (types.ModuleType, type, types.ClassType, types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType, types.CodeType, types.FrameType)
+
+# objects that don't refer to anything
+_leaf_types = frozenset((int, long, float, complex, str, unicode))
+
+# returns the size of obj and everything reachable from it, in bytes
+# a number or string that nothing else refers to can't be reached twice, so it's counted
+#  without remembering it. otherwise a list of millions of numbers would take more memory to
+#  measure than it takes itself
+def deep_size(obj):
+    if isinstance(obj, _shared_types):
+        return sys.getsizeof(obj)
+    # bound locally, since the loop runs for every object reached
+    getsizeof, getrefcount, get_referents = sys.getsizeof, sys.getrefcount, gc.get_referents
+    leaf_types, shared_types = _leaf_types, _shared_types
+    seen = set([id(obj)])
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        size += getsizeof(obj, 0)
+        for referent in get_referents(obj):
+            # referred to by obj, the list of referents, referent and getrefcount's argument
+            if type(referent) in leaf_types and getrefcount(referent) <= 4:
+                size += getsizeof(referent, 0)
+            elif id(referent) not in seen and not isinstance(referent, shared_types):
+                seen.add(id(referent))
+                stack.append(referent)
+    return size
+
+def _fingerprint(value):
+    try:
+        length = len(value)
+    except Exception:
+        length = None
+    return id(value), length, sys.getsizeof(value, 0)
+
+class Size_Cache():
+    def __init__(self, namespace):
+        self.namespace = namespace
+        # name: (fingerprint, deep size)
+        self.sizes = {}
+        self.pending = set()
+
+    # records the names used by a statement that just ran, since those are the names whose
+    #  values it could have changed
+    def note_code(self, code):
+        names = getattr(code, 'co_names', None)
+        if names:
+            self.pending.update(names)
+
+    # returns the deep size of the value bound to name
+    def size(self, name, refresh=False):
+        value = self.namespace[name]
+        fingerprint = _fingerprint(value)
+        cached = self.sizes.get(name)
+        if refresh or cached is None or cached[0] != fingerprint or name in self.pending:
+            cached = (fingerprint, deep_size(value))
+            self.sizes[name] = cached
+            self.pending.discard(name)
+        return cached[1]
+
+    # returns (name, deep size) for every name not in exclude, largest first
+    def all_sizes(self, exclude=(), refresh=False):
+        for name in list(self.sizes):
+            if name not in self.namespace:
+                del self.sizes[name]
+        sizes = [(name, self.size(name, refresh)) for name in list(self.namespace)
+                 if name not in exclude and not name.startswith('__')]
+        self.pending.clear()
+        sizes.sort(key=lambda item: item[1], reverse=True)
+        return sizes
+
+# measures the process's memory
+# the resident set size is what the system sees, but it can't tell what a statement
+#  allocated: malloc reuses memory that was freed without returning it to the system, so a
+#  statement can allocate a lot without it changing. where glibc's mallinfo2() is available,
+#  allocated() counts the bytes malloc has handed out and not had back instead
+class Memory_Reader():
+    def __init__(self):
+        self.fd = None
+        self.pid = None
+        self.page_size = resource.getpagesize()
+        # the mallinfo2 function, False where there isn't one, or None until it's looked for
+        self.mallinfo = None
+
+    # returns the resident set size, in bytes
+    # on Linux it's read from /proc/self/statm, through a file descriptor that's kept open
+    #  (and reopened after a fork, since it describes the process that opened it). elsewhere
+    #  there's only the peak resident set size
+    def rss(self):
+        if self.pid != os.getpid():
+            if self.fd is not None:
+                os.close(self.fd)
+            self.pid = os.getpid()
+            try:
+                self.fd = os.open('/proc/self/statm', os.O_RDONLY)
+            except OSError:
+                self.fd = None
+        if self.fd is None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes, except on OS X
+            return peak if sys.platform == 'darwin' else peak * 1024
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        return int(os.read(self.fd, 256).split()[1]) * self.page_size
+
+    # returns the bytes malloc has allocated, or the resident set size without mallinfo2
+    # ctypes is only imported the first time, since importing it takes longer than the rest
+    #  of the console's modules
+    def allocated(self):
+        if self.mallinfo is None:
+            self.mallinfo = _mallinfo()
+        if not self.mallinfo:
+            return self.rss()
+        info = self.mallinfo()
+        # small allocations and those mapped separately
+        return info.uordblks + info.hblkhd
+
+# returns glibc's mallinfo2 function, or False if there isn't one
+def _mallinfo():
+    try:
+        import ctypes
+        class Mallinfo(ctypes.Structure):
+            _fields_ = [(name, ctypes.c_size_t) for name in ('arena', 'ordblks', 'smblks', 'hblks', 'hblkhd', 'usmblks',
+                                                              'fsmblks', 'uordblks', 'fordblks', 'keepcost')]
+        # the symbols of the process itself, which include the C library's
+        mallinfo = ctypes.CDLL(None).mallinfo2
+    except (ImportError, OSError, AttributeError):
+        return False
+    mallinfo.restype = Mallinfo
+    return mallinfo
+
+# asks the C allocator to give memory that's been freed back to the system, where it can
+#  (glibc's malloc_trim), and returns whether it could
+def trim():
+    try:
+        import ctypes
+        ctypes.CDLL(None).malloc_trim(0)
+    except (ImportError, OSError, AttributeError):
+        return False
+    return True
@@ -0,0 +1,373 @@
+# parallel map and filter used by pmap() and pfilter() in default_functions.py
+# items are sent to the workers in chunks, and results come back a chunk at a time, in the
+#  order of the items or as each chunk finishes. only a few chunks per worker are in flight
+#  at once, so an iterable of millions of records (or a generator) is never all in memory,
+#  and results can be consumed as they arrive
+# chunk sizes are chosen as it runs: chunks start small and grow until each takes about
+#  target_seconds in a worker, so a cheap function isn't swamped by the cost of sending each
+#  item, and an expensive one still spreads evenly. when the number of items is known,
+#  chunks are also kept small enough to give every worker several
+# process workers are forked from the console when the call starts, so they already have
+#  the function, even a lambda or anything else defined at the prompt that pickle can't
+#  find by name, along with the namespace as it is at the time. only the items and the
+#  results are pickled. thread workers share the console's memory and need no pickling,
+#  but only run in parallel while the function is outside python code, like in I/O or
+#  numpy. what process workers print goes straight to the terminal, without being logged
+# a Ctrl-C, an error in the function or closing the generator early kills the workers
+import os, sys
+import time, errno, fcntl, select, signal, struct, cPickle, threading, traceback, Queue
+from itertools import islice
+
+_header = struct.Struct('!I')
+
+# raised in the console when the function failed in a worker, with the worker's traceback
+class Worker_Error(Exception):
+    pass
+
+def cpu_count():
+    try:
+        return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+    except (ValueError, OSError):
+        return 1
+
+# runs function over a chunk of items that starts at item start, and returns the results
+#  and how long it took, or the error if it failed
+# if keep is set, the results are the items for which function returned true
+def _run_chunk(function, keep, start, items):
+    started = time.time()
+    results = []
+    append = results.append
+    index = start
+    try:
+        if keep:
+            for item in items:
+                if function(item):
+                    append(item)
+                index += 1
+        else:
+            for item in items:
+                append(function(item))
+                index += 1
+    except Exception:
+        etype, value, tb = sys.exc_info()
+        # leaves out this function's own frame
+        error = ''.join(traceback.format_exception(etype, value, tb.tb_next))
+        item = repr(items[index - start])
+        if len(item) > 80:
+            item = item[:77] + '...'
+        return 'error', 'The function failed on item {:d}, {:s}:\n{:s}'.format(index, item, error)
+    return 'done', (results, time.time() - started, len(items))
+
+# workers that are threads in the console's process
+# submit() queues a chunk, and results() returns the chunks finished so far as
+#  (chunk id, outcome) pairs, where outcome is what _run_chunk() returned
+class Thread_Workers():
+    def __init__(self, function, keep, count):
+        self.function = function
+        self.keep = keep
+        self.tasks = Queue.Queue()
+        self.finished = Queue.Queue()
+        self.stopped = False
+        self.threads = []
+        for _ in range(count):
+            thread = threading.Thread(target=self._work, name='pmap worker')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None or self.stopped:
+                return
+            chunk_id, start, items = task
+            self.finished.put((chunk_id, _run_chunk(self.function, self.keep, start, items)))
+
+    def submit(self, chunk_id, start, items):
+        self.tasks.put((chunk_id, start, items))
+
+    # waits up to timeout seconds for a chunk to finish
+    def results(self, timeout):
+        try:
+            finished = [self.finished.get(timeout=timeout)]
+        except Queue.Empty:
+            return []
+        try:
+            while True:
+                finished.append(self.finished.get_nowait())
+        except Queue.Empty:
+            return finished
+
+    # threads can't be killed, so a thread that's running a chunk stops once it's done
+    # each thread stops at the first of the sentinels queued after the remaining chunks,
+    #  or at its next chunk if kill is set
+    def close(self, kill=False):
+        self.stopped = kill
+        for _ in self.threads:
+            self.tasks.put(None)
+
+# workers that are forked processes
+# each worker has a pipe for its chunks and one for its results, with each message a
+#  pickle preceded by its length. the console's ends are non-blocking and only written as
+#  the worker reads, so neither side can block the other while both have a lot to send
+class Process_Workers():
+    def __init__(self, function, keep, count):
+        # for each worker, keyed by its result pipe: its pid, its chunk pipe, the chunk data
+        #  not yet written and the result data not yet parsed
+        self.workers = {}
+        for _ in range(count):
+            task_read, task_write = os.pipe()
+            result_read, result_write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                # never returns, and never runs the console's exit handlers or flushes its logs
+                try:
+                    os.close(task_write)
+                    os.close(result_read)
+                    # the other workers' pipes, which would keep them from seeing the end of
+                    #  their input
+                    for worker in self.workers.values():
+                        os.close(worker['tasks'])
+                        os.close(worker['results'])
+                    _worker(function, keep, task_read, result_write)
+                finally:
+                    os._exit(1)
+            os.close(task_read)
+            os.close(result_write)
+            for fd in (task_write, result_read):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self.workers[result_read] = {'pid': pid, 'tasks': task_write, 'results': result_read,
+                                         'pending': '', 'received': '', 'chunks': 0}
+
+    # queues a chunk for the worker with the fewest chunks in flight
+    def submit(self, chunk_id, start, items):
+        try:
+            data = cPickle.dumps((chunk_id, start, items), cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise TypeError("Items sent to worker processes have to be pickled, and these couldn't be ({:s}: {:s}). "
+                            "Use threads=True to run the function on threads instead.".format(type(e).__name__, str(e)))
+        worker = min(self.workers.values(), key=lambda worker: worker['chunks'])
+        worker['pending'] += _header.pack(len(data)) + data
+        worker['chunks'] += 1
+        self._write(worker)
+
+    def _write(self, worker):
+        try:
+            written = os.write(worker['tasks'], worker['pending'][:1048576])
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return
+        worker['pending'] = worker['pending'][written:]
+
+    # waits up to timeout seconds for a chunk to finish, while writing queued chunks
+    def results(self, timeout):
+        finished = []
+        deadline = time.time() + timeout
+        while not finished:
+            writing = [worker['tasks'] for worker in self.workers.values() if worker['pending']]
+            remaining = max(0, deadline - time.time())
+            try:
+                readable, writable = select.select(list(self.workers), writing, [], remaining)[:2]
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            for worker in self.workers.values():
+                if worker['tasks'] in writable:
+                    self._write(worker)
+            for fd in readable:
+                worker = self.workers[fd]
+                data = os.read(fd, 1048576)
+                if not data:
+                    raise Worker_Error('A worker process (pid {:d}) exited before it finished.'.format(worker['pid']))
+                worker['received'] += data
+                finished.extend(self._parse(worker))
+            if not readable and not writable:
+                break
+        return finished
+
+    # returns the complete messages a worker has sent
+    def _parse(self, worker):
+        messages = []
+        received = worker['received']
+        offset = 0
+        while len(received) - offset >= _header.size:
+            length = _header.unpack_from(received, offset)[0]
+            if len(received) - offset - _header.size < length:
+                break
+            offset += _header.size
+            messages.append(cPickle.loads(received[offset:offset + length]))
+            offset += length
+            worker['chunks'] -= 1
+        worker['received'] = received[offset:]
+        return messages
+
+    # closing a worker's chunk pipe tells it to exit once it has finished
+    def close(self, kill=False):
+        for worker in self.workers.values():
+            if kill:
+                try:
+                    os.kill(worker['pid'], signal.SIGKILL)
+                except OSError:
+                    pass
+            os.close(worker['tasks'])
+            os.close(worker['results'])
+        for worker in self.workers.values():
+            os.waitpid(worker['pid'], 0)
+        self.workers = {}
+
+# runs in a worker process, running chunks until its input ends
+def _worker(function, keep, task_read, result_write):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGPIPE):
+        signal.signal(signum, signal.SIG_DFL)
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
+    tasks = os.fdopen(task_read, 'rb')
+    results = os.fdopen(result_write, 'wb')
+    while True:
+        header = tasks.read(_header.size)
+        if len(header) < _header.size:
+            break
+        chunk_id, start, items = cPickle.loads(tasks.read(_header.unpack(header)[0]))
+        outcome = _run_chunk(function, keep, start, items)
+        try:
+            data = cPickle.dumps((chunk_id, outcome), cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = cPickle.dumps((chunk_id, ('error', "The results of the chunk starting at item {:d} couldn't be pickled "
+                                              "({:s}: {:s}).".format(start, type(e).__name__, str(e)))))
+        results.write(_header.pack(len(data)) + data)
+        results.flush()
+    sys.stdout.flush()
+    os._exit(0)
+
+# picks the size of each chunk from how long the chunks so far took
+class Chunk_Sizer():
+    # size is a fixed chunk size, or None to choose it as it goes
+    def __init__(self, size, total, workers, target_seconds=0.05):
+        self.fixed = size is not None
+        self.size = size or 8
+        self.target_seconds = target_seconds
+        # at least four chunks for each worker
+        self.limit = max(1, total // (workers * 4)) if total is not None else None
+
+    def next(self):
+        if self.fixed or self.limit is None:
+            return self.size
+        return min(self.size, self.limit)
+
+    # count items took seconds in a worker
+    def observe(self, count, seconds):
+        if self.fixed:
+            return
+        if seconds <= 0:
+            ideal = self.size * 4
+        else:
+            ideal = self.target_seconds * count / seconds
+        # grows at most fourfold at a time, since the first chunks' times are the least reliable
+        self.size = int(max(1, min(ideal, self.size * 4)))
+
+# a line on the terminal showing how many items are done, redrawn in place at most every
+#  interval seconds, or straight away once it's been cleared
+# only shown on an interactive terminal, from the main thread (not in a background job),
+#  and once the call has run for delay seconds, so quick calls don't flicker
+class Progress():
+    def __init__(self, label, total, delay=0.5, interval=0.1):
+        self.label = label
+        self.total = total
+        self.started = time.time()
+        self.delay = delay
+        self.interval = interval
+        self.drawn = 0
+        self.shown = False
+        stream = sys.__stderr__
+        self.stream = stream if stream.isatty() and isinstance(threading.current_thread(), threading._MainThread) else None
+
+    def update(self, done):
+        if self.stream is None:
+            return
+        now = time.time()
+        if now - self.started < self.delay or (self.shown and now - self.drawn < self.interval):
+            return
+        self.drawn = now
+        if self.total:
+            line = '[{:s}] {:d}/{:d} items, {:d}%, {:.1f}s'.format(self.label, done, self.total, 100 * done // self.total,
+                                                                  now - self.started)
+        else:
+            line = '[{:s}] {:d} items, {:.1f}s'.format(self.label, done, now - self.started)
+        self.stream.write('\r\x1b[K' + line)
+        self.stream.flush()
+        self.shown = True
+
+    def clear(self):
+        if self.shown:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+            self.shown = False
+
+# returns a generator of function(item) for each item in iterable
+# keep, workers, threads, chunk_size and ordered are as described for pmap() and pfilter()
+# stream is whether whatever consumes the results might print between them, in which case
+#  the progress line is cleared before they're yielded
+def imap(function, iterable, keep=False, workers=None, threads=False, chunk_size=None, ordered=True, stream=False,
+         label='pmap'):
+    workers = workers or cpu_count()
+    try:
+        total = len(iterable)
+    except TypeError:
+        total = None
+    items = iter(iterable)
+    sizer = Chunk_Sizer(chunk_size, total, workers)
+    progress = Progress(label, total)
+    pool = (Thread_Workers if threads else Process_Workers)(function, keep, workers)
+    finished = False
+    try:
+        # chunks sent or finished but not yet yielded, which is at most window
+        window = workers * 4
+        waiting = {}
+        in_flight = 0
+        next_chunk = 0
+        next_yield = 0
+        start = 0
+        done = 0
+        exhausted = False
+        while True:
+            while not exhausted and in_flight + len(waiting) < window:
+                chunk = list(islice(items, sizer.next()))
+                if not chunk:
+                    exhausted = True
+                    break
+                pool.submit(next_chunk, start, chunk)
+                next_chunk += 1
+                start += len(chunk)
+                in_flight += 1
+            if not in_flight and not waiting:
+                break
+            for chunk_id, (status, outcome) in pool.results(progress.interval):
+                in_flight -= 1
+                if status == 'error':
+                    raise Worker_Error(outcome)
+                results, seconds, count = outcome
+                sizer.observe(count, seconds)
+                done += count
+                waiting[chunk_id] = results
+            # the chunks that can be yielded now
+            if ordered:
+                ready = []
+                while next_yield in waiting:
+                    ready.append(waiting.pop(next_yield))
+                    next_yield += 1
+            else:
+                ready = waiting.values()
+                waiting.clear()
+            if ready and stream:
+                progress.clear()
+            for results in ready:
+                for result in results:
+                    yield result
+            progress.update(done)
+        finished = True
+    finally:
+        progress.clear()
+        pool.close(kill=not finished)
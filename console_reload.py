@@ -0,0 +1,116 @@
+# keeps track of what each function file registered, so a file can be run again after it's
+#  edited without restarting the console
+# each file runs with an export dict of its own, swapped into console_lib_tools while it
+#  runs, so its variables and special commands are known apart from every other file's.
+#  help entries all go to the one dict that the help command reads, so a file's entries
+#  are the ones it added or replaced while it ran
+# the files' exports are layered in a fixed order, later files taking precedence, and
+#  reload() runs one file again and applies the difference the new exports make to the
+#  layering. a name in the namespace is only rebound or removed if it still holds what was
+#  exported before, so anything assigned at the prompt is left alone
+import os
+
+_missing = object()
+
+# returns what's used to tell whether a file has changed, or None if it's gone
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+class Function_Files():
+    # load_source runs a file as a module, given the module's name and the file's path
+    # order is the names of the modules in the order their exports are layered
+    def __init__(self, lib_tools, load_source, order):
+        self.lib_tools = lib_tools
+        self.load_source = load_source
+        self.order = order
+        # for each module: its path, the file's mtime and size when it was loaded, and the
+        #  variables, special commands and help entries it registered
+        self.files = {}
+
+    # runs the file at path as the module name and records what it registers
+    # raises IOError if the file doesn't exist, as imp.load_source would
+    def load(self, name, path):
+        tools = self.lib_tools.export_dict
+        shared = tools['export_dict']
+        help_info = tools['help_function_info']
+        help_before = dict(help_info)
+        exports = {'~special_commands': {}}
+        stat = _stat(path)
+        tools['export_dict'] = exports
+        try:
+            module = self.load_source(name, path)
+        except:
+            # the file isn't reloaded again until it's changed again
+            if name in self.files:
+                self.files[name]['stat'] = stat
+            raise
+        finally:
+            tools['export_dict'] = shared
+        variables = dict(exports)
+        commands = variables.pop('~special_commands')
+        self.files[name] = {'path': path, 'stat': stat, 'variables': variables, 'commands': commands,
+                            'help': {key: info for key, info in help_info.items() if help_before.get(key) is not info}}
+        return module
+
+    # returns the variables, special commands and help entries of every file, layered
+    def merged(self):
+        variables, commands, help = {}, {}, {}
+        for name in self.order:
+            if name in self.files:
+                variables.update(self.files[name]['variables'])
+                commands.update(self.files[name]['commands'])
+                help.update(self.files[name]['help'])
+        return variables, commands, help
+
+    # returns the names of the modules whose files have changed since they were loaded
+    def changed(self):
+        return [name for name in self.order if name in self.files
+                and _stat(self.files[name]['path']) not in (None, self.files[name]['stat'])]
+
+    # returns the name of the module loaded from a file, given the module's name, the name
+    #  without "_functions" (like "custom"), or the file's name
+    def find(self, text):
+        for name in self.order:
+            if name in self.files and text in (name, name.replace('_functions', ''), os.path.basename(self.files[name]['path'])):
+                return name
+        raise ValueError('No function file called "{:s}". The function files are: {:s}.'.format(
+            text, ', '.join(os.path.basename(self.files[name]['path']) for name in self.order if name in self.files)))
+
+    # runs a file again and updates the namespace, special_commands and help_info to match
+    # returns the names that were bound, removed, or left alone because they were assigned
+    #  since the file was last loaded
+    def reload(self, name, namespace, special_commands, help_info):
+        old_variables, old_commands, old_help = self.merged()
+        self.load(name, self.files[name]['path'])
+        new_variables, new_commands, new_help = self.merged()
+        summary = {'bound': [], 'removed': [], 'kept': []}
+        for key in set(old_variables) | set(new_variables):
+            before = old_variables.get(key, _missing)
+            after = new_variables.get(key, _missing)
+            if before is after:
+                continue
+            current = namespace.get(key, _missing)
+            if current is not before and current is not _missing:
+                summary['kept'].append(key)
+            elif after is _missing:
+                if current is not _missing:
+                    del namespace[key]
+                summary['removed'].append(key)
+            else:
+                namespace[key] = after
+                summary['bound'].append(key)
+        # the files' commands and help entries are replaced, unless something else (like
+        #  the console's own commands) has taken their place
+        for table, before, after in ((special_commands, old_commands, new_commands), (help_info, old_help, new_help)):
+            for key, entry in before.items():
+                if table.get(key) is entry:
+                    del table[key]
+            for key, entry in after.items():
+                table.setdefault(key, entry)
+        for names in summary.values():
+            names.sort()
+        return summary
@@ -0,0 +1,219 @@
+# server that keeps a preloaded console process running, so a session starts without
+#  starting the interpreter, importing modules or running the function files again
+# started by "python_console.py --server" once the default and custom function files are
+#  loaded. serve() detaches from the terminal and forks a process for each connection from
+#  console_client.py, which starts with a copy-on-write copy of the preloaded state. that
+#  process forks the session with a new pseudo-terminal as its controlling terminal, then
+#  relays between the pseudo-terminal and the client
+# serve() only returns in a session, once it has the client's working directory,
+#  environment and arguments, so python_console.py carries on from there as it would
+#  without the server: it loads the project's console_lib.py and handles --log and every
+#  other argument for the session
+# if any of the console's files have changed since the server started, the client is told
+#  to run the console directly and the server restarts itself, so sessions never run code
+#  that's out of date
+# a session is code running as the server's user, so the socket is only ever accessible to
+#  that user, and on linux each connection's user is checked before anything it sends is read
+import os, sys
+import imp, glob, errno, fcntl, struct, select, signal, socket, marshal, termios
+
+console_client = imp.load_source('console_client', os.path.join(os.path.dirname(__file__), 'console_client.py'))
+
+# returns the modification time and size of each python file in the console's directory
+def _snapshot(file_dir):
+    snapshot = {}
+    for path in glob.glob(os.path.join(file_dir, '*.py')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshot[path] = (stat.st_mtime, stat.st_size)
+    return snapshot
+
+# python 2's socket module doesn't define SO_PEERCRED, so linux's value is used
+_peer_credentials = getattr(socket, 'SO_PEERCRED', 17 if sys.platform.startswith('linux') else None)
+_credentials = struct.Struct('3i')
+
+# returns the user id of the process at the other end of connection, or None if the
+#  platform can't tell
+def _peer_uid(connection):
+    if _peer_credentials is None:
+        return None
+    try:
+        return _credentials.unpack(connection.getsockopt(socket.SOL_SOCKET, _peer_credentials, _credentials.size))[1]
+    except (socket.error, struct.error):
+        return None
+
+# reaps any connection processes that have exited
+def _reap():
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except OSError:
+        pass
+
+def _exit_status(status):
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+# starts serving on socket_path, and only returns in a session's process
+# restart is the command that starts a new server in place of this one
+def serve(socket_path, file_dir, restart):
+    if console_client.connect() is not None:
+        sys.stderr.write('A console server is already running at {:s}.\n'.format(socket_path))
+        sys.exit(1)
+    # left behind by a server that didn't exit cleanly
+    try:
+        os.remove(socket_path)
+    except OSError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # created without access for anyone else from the start, rather than changed afterwards
+    umask = os.umask(0077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(umask)
+    listener.listen(16)
+    pid = os.fork()
+    if pid:
+        print 'Started the console server at {:s} (pid {:d}).'.format(socket_path, pid)
+        os._exit(0)
+    os.setsid()
+    server_pid = os.getpid()
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+    os.close(null)
+    snapshot = _snapshot(file_dir)
+    def stop(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        while True:
+            # wakes up now and then to reap the connection processes
+            if not select.select([listener], [], [], 1.0)[0]:
+                _reap()
+                continue
+            connection = listener.accept()[0]
+            _reap()
+            uid = _peer_uid(connection)
+            if uid is not None and uid != os.getuid():
+                connection.close()
+                continue
+            # the client sends its first message as soon as it connects
+            connection.settimeout(1.0)
+            reader = console_client.Message_Reader(connection)
+            try:
+                kind, payload = reader.next()
+            except (EOFError, socket.error):
+                connection.close()
+                continue
+            connection.settimeout(None)
+            if kind == 's':
+                _reply(connection, 'x', '0')
+                sys.exit(0)
+            if _snapshot(file_dir) != snapshot:
+                _reply(connection, 'f')
+                listener.close()
+                os.remove(socket_path)
+                os.execv(restart[0], restart)
+            if _connect(listener, connection, reader, marshal.loads(payload)):
+                return
+    finally:
+        # sessions return through here too, but the socket file is the server's
+        if os.getpid() == server_pid:
+            try:
+                os.remove(socket_path)
+            except OSError:
+                pass
+
+# sends a last message to a client, which may have gone already
+def _reply(connection, kind, payload=''):
+    try:
+        console_client.send(connection, kind, payload)
+    except socket.error:
+        pass
+    connection.close()
+
+# forks the process that handles a connection, and returns True in the session it starts
+# the connection's process never returns
+def _connect(listener, connection, reader, hello):
+    if os.fork():
+        connection.close()
+        return False
+    status = 1
+    session = False
+    try:
+        listener.close()
+        for signum in (signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        master, slave = os.openpty()
+        # sized before the session starts, so readline sees the client's terminal size
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, console_client._window_size.pack(*hello['size']))
+        pid = os.fork()
+        if pid == 0:
+            os.close(master)
+            connection.close()
+            session = True
+            _start_session(slave, hello)
+            return True
+        os.close(slave)
+        console_client.send(connection, 'r')
+        status = _relay(connection, reader, master, pid)
+        console_client.send(connection, 'x', str(status))
+    except (EOFError, socket.error):
+        pass
+    finally:
+        if not session:
+            os._exit(status)
+
+# makes the terminal the session's controlling terminal and its stdin, stdout and stderr,
+#  and takes on the client's working directory, environment and arguments
+def _start_session(slave, hello):
+    os.setsid()
+    fcntl.ioctl(slave, termios.TIOCSCTTY, 0)
+    for fd in (0, 1, 2):
+        os.dup2(slave, fd)
+    os.close(slave)
+    os.chdir(hello['cwd'])
+    os.environ.clear()
+    os.environ.update(hello['env'])
+    sys.argv[1:] = hello['argv']
+
+# relays between the session's terminal and the client until the session exits, and
+#  returns its exit status
+# input is only written to the terminal as fast as the session reads it, so a large paste
+#  can't block the relay while the session is blocked writing output
+def _relay(connection, reader, master, pid):
+    fcntl.fcntl(master, fcntl.F_SETFL, fcntl.fcntl(master, fcntl.F_GETFL) | os.O_NONBLOCK)
+    pending = ''
+    try:
+        while True:
+            ready, writable = select.select([connection, master], [master] if pending else [], [])[:2]
+            if writable:
+                pending = pending[os.write(master, pending):]
+            if master in ready:
+                try:
+                    data = os.read(master, 65536)
+                except OSError as e:
+                    # the terminal is closed once the session has exited
+                    if e.errno != errno.EIO:
+                        raise
+                    break
+                if not data:
+                    break
+                console_client.send(connection, 'd', data)
+            if connection in ready:
+                for kind, payload in reader.read():
+                    if kind == 'd':
+                        pending += payload
+                    elif kind == 'w':
+                        fcntl.ioctl(master, termios.TIOCSWINSZ, payload)
+    except (EOFError, socket.error):
+        # the client has gone, so closing the terminal hangs up the session
+        pass
+    os.close(master)
+    return _exit_status(os.waitpid(pid, 0)[1])
@@ -0,0 +1,267 @@
+# structured log of each statement run in the console, alongside the plain text log
+# each statement is appended to <log>.jsonl as one line of JSON, with the session it ran
+#  in, when it started, its input, what it printed to stdout and stderr, and its timings
+# each line also gets a fixed size record in the sidecar index <log>.jsonl.idx, with the
+#  time it was written, its session and where it is in the log. records are written under
+#  an exclusive lock, so several sessions can share a log, and the index stays in time
+#  order, so a time range is found with a binary search
+# records are encoded and written in batches by a background thread, so a statement
+#  doesn't wait on the lock or the disk. the thread is woken once enough records are
+#  pending, or after a short interval, rather than for every statement
+# search() reads both files through mmap, so a search only touches the parts of the log it
+#  needs instead of loading the whole file
+# strings are stored as latin-1 code points, so any bytes a statement printed round trip,
+#  whatever their encoding
+import os, sys
+import time, json, mmap, fcntl, struct, binascii, threading
+from collections import deque
+
+# time the record was written, session id, offset in the log, length in the log
+_index_record = struct.Struct('<d8sQI')
+
+# collects what's written to a stream, keeping the first limit bytes
+class Output_Capture():
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.total = 0
+
+    def write(self, string):
+        self.total += len(string)
+        if self.size < self.limit:
+            part = string[:self.limit - self.size]
+            self.parts.append(part)
+            self.size += len(part)
+
+    def getvalue(self):
+        value = ''.join(self.parts)
+        if self.total > self.size:
+            value += '\n... [{:d} bytes omitted]\n'.format(self.total - self.size)
+        return value
+
+class Session_Log():
+    # streams are the (stdout, stderr) loggers whose capture attribute is set while a
+    #  statement runs
+    # limit is the most that's kept of each of a statement's stdout and stderr
+    def __init__(self, path, streams, limit=65536, batch_size=64, flush_interval=0.5):
+        self.path = path
+        self.streams = streams
+        self.limit = limit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session = binascii.hexlify(os.urandom(4))
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        self.index_fd = os.open(path + '.idx', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        self.start_time = None
+        # records waiting to be written, and markers that flush() and close() wait on.
+        #  appending to and draining a deque are atomic, so finish() doesn't take a lock
+        self.pending = deque()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='structured log writer')
+        # the thread is stopped by close(), which the console registers with atexit
+        self.thread.daemon = True
+        self.thread.start()
+
+    # starts capturing a statement's output
+    def start(self):
+        self.start_time = time.time()
+        for stream in self.streams:
+            stream.capture = Output_Capture(self.limit)
+
+    # stops capturing and writes the statement's record
+    # stats is the statement's record from Statement_Stats, or None if it didn't run
+    def finish(self, source, stats=None):
+        # a statement can stop its own output being captured by unsetting capture
+        out, err = [stream.capture.getvalue() if stream.capture is not None else '' for stream in self.streams]
+        for stream in self.streams:
+            stream.capture = None
+        record = {'session': self.session, 'time': self.start_time, 'input': source, 'output': out, 'error': err}
+        if stats is not None:
+            for key in ('wall', 'cpu', 'memory', 'allocated'):
+                record[key] = stats[key]
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.wake.set()
+
+    # blocks until every record so far has been written, or for at most timeout seconds
+    # returns straight away once the log is closed or the writer thread has died
+    def flush(self, timeout=5):
+        if self.thread.is_alive():
+            self._mark(threading.Event(), timeout)
+
+    # writes any records still pending, then closes the log
+    # the files are closed by the writer thread once it's written everything, so they're
+    #  never closed under it if it's still busy when the wait for it times out
+    # safe to call more than once
+    def close(self, timeout=5):
+        if not self.thread.is_alive():
+            return
+        self._mark(None, timeout)
+        self.thread.join(timeout)
+
+    # queues a marker after the pending records and waits for the thread to reach it, as
+    #  long as the thread is still running
+    # None stops the thread
+    def _mark(self, marker, timeout):
+        self.pending.append(marker)
+        self.wake.set()
+        if marker is None:
+            return
+        deadline = time.time() + timeout
+        while not marker.is_set() and self.thread.is_alive() and time.time() < deadline:
+            marker.wait(0.05)
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            records = []
+            try:
+                while True:
+                    item = self.pending.popleft()
+                    if isinstance(item, dict):
+                        records.append(item)
+                        continue
+                    # records before a marker are written before it's released
+                    self._write(records)
+                    records = []
+                    if item is None:
+                        os.close(self.fd)
+                        os.close(self.index_fd)
+                        return
+                    item.set()
+            except IndexError:
+                pass
+            self._write(records)
+
+    # writes a batch of records, under a single lock, with a single write to each file
+    def _write(self, records):
+        if not records:
+            return
+        try:
+            lines = [json.dumps(_latin_1(record)) + '\n' for record in records]
+            data = ''.join(lines)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                os.write(self.fd, data)
+                # nobody else can append while the lock is held, so the batch ends here
+                offset = os.lseek(self.fd, 0, os.SEEK_END) - len(data)
+                now = time.time()
+                index = []
+                for line in lines:
+                    index.append(_index_record.pack(now, self.session, offset, len(line)))
+                    offset += len(line)
+                os.write(self.index_fd, ''.join(index))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        except Exception as e:
+            # printed straight to the terminal, since there's no one to raise it to
+            sys.__stderr__.write('Error writing to the structured log "{:s}": {:s}\n'.format(self.path, str(e)))
+
+# returns the fields of the index record at position
+def _index_entry(index, position):
+    return _index_record.unpack_from(index, position * _index_record.size)
+
+# returns the position of the first index record written at or after when
+def _bisect_time(index, count, when):
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if _index_entry(index, middle)[0] < when:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+# returns record with its strings decoded as latin-1, which json encodes much faster than
+#  it decodes them itself
+def _latin_1(record):
+    return {key: value.decode('latin-1') if isinstance(value, str) else value for key, value in record.iteritems()}
+
+def _decode(line):
+    record = json.loads(line)
+    for key in ('session', 'input', 'output', 'error'):
+        record[key] = record[key].encode('latin-1')
+    return record
+
+def _map(path):
+    try:
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except IOError:
+        return None
+
+# returns the most recent limit records, oldest first, that match all of the given
+#  conditions: text in the input, output or error, written by session, and written between
+#  since and until (seconds since the epoch)
+def search(path, text='', session=None, since=None, until=None, limit=20):
+    data = _map(path)
+    if data is None:
+        return []
+    index = _map(path + '.idx')
+    try:
+        count = len(index) // _index_record.size if index is not None else 0
+        low, high = 0, count
+        if since is not None:
+            low = _bisect_time(index, count, since)
+        if until is not None:
+            high = _bisect_time(index, count, until)
+        if low >= high and (since is not None or until is not None):
+            return []
+        # the part of the log written in the time range. without one, the whole log is
+        #  searched, including any records whose index records were never written
+        start, end = 0, len(data)
+        if since is not None:
+            start = _index_entry(index, low)[2]
+        if until is not None:
+            last = _index_entry(index, high - 1)
+            end = last[2] + last[3]
+        records = []
+        if text:
+            needle = json.dumps(text.decode('latin-1'))[1:-1]
+            while len(records) < limit:
+                found = data.rfind(needle, start, end)
+                if found < 0:
+                    break
+                line_start = data.rfind('\n', start, found) + 1
+                line_end = data.find('\n', found, len(data))
+                if line_end < 0:
+                    line_end = len(data)
+                end = line_start
+                try:
+                    record = _decode(data[line_start:line_end])
+                except ValueError:
+                    # a record that's still being written
+                    continue
+                if session is not None and record['session'] != session:
+                    continue
+                if any(text in record[key] for key in ('input', 'output', 'error')):
+                    records.append(record)
+        else:
+            position = high
+            search_end = high * _index_record.size
+            while position > low and len(records) < limit:
+                if session is not None:
+                    # find the session id in the index itself, instead of unpacking each record
+                    found = index.rfind(session, low * _index_record.size, search_end)
+                    if found < 0:
+                        break
+                    # the same bytes somewhere other than a record's session id
+                    if (found - 8) % _index_record.size:
+                        search_end = found + len(session) - 1
+                        continue
+                    position = found // _index_record.size
+                    search_end = position * _index_record.size
+                else:
+                    position -= 1
+                offset, length = _index_entry(index, position)[2:]
+                records.append(_decode(data[offset:offset + length]))
+        records.reverse()
+        return records
+    finally:
+        data.close()
+        if index is not None:
+            index.close()
@@ -0,0 +1,260 @@
+# shell support used by shell(), shell_stream() and "%" lines in default_functions.py
+# commands can run in a new shell each time, with stream_once(), or in a long-lived shell
+#  coprocess, with Shell_Session.stream(). both return a generator of the command's output
+#  as it arrives, as ('out', chunk) and ('err', chunk) pairs, followed by a final
+#  ('status', <exit status>) pair. if the generator is closed early, or a Ctrl-C arrives
+#  while it's waiting for output, the command is killed
+import os
+import atexit, binascii, select, signal, threading, weakref
+from collections import deque
+from subprocess import Popen, PIPE
+
+# long-lived shell coprocess
+# commands are written to the shell's stdin one at a time, each followed by a marker that
+#  the shell prints to stdout (with the command's exit status) and to stderr once the
+#  command has finished. the marker is a random token, so it can't be confused with the
+#  command's own output, and it's printed straight after it, so output that doesn't end
+#  in a line break is returned as it is
+# commands run through "command eval", so "cd", "export" and aliases carry over to later
+#  commands, and a syntax error is reported like any other error instead of killing the shell
+# the shell is started in its own process group, so a Ctrl-C at the console only reaches
+#  it through the output generator, which kills it. the next command then starts a new shell
+# the shell runs one command at a time. while a command's output is still being read, from
+#  another thread or from inside the loop reading it, other commands run in a new shell
+class Shell_Session():
+    def __init__(self, shell='/bin/sh'):
+        self.shell = shell
+        self.enabled = False
+        self.process = None
+        self.token = None
+        self.cwd = None
+        self.lock = threading.Lock()
+        # weak reference to the output generator of the command that's running
+        self.owner = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = Popen([self.shell], stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                             close_fds=True, preexec_fn=_child_setup)
+        self.token = 'pycon-{:s}'.format(binascii.hexlify(os.urandom(8)))
+        self.cwd = None
+
+    # kills the shell and anything it's running
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        for f in (self.process.stdin, self.process.stdout, self.process.stderr):
+            f.close()
+        self.process = None
+
+    # sends command to the shell and returns a generator of its output
+    # the shell follows the console's working directory, so it changes directory first if
+    #  the console has changed directory since the last command. changing directory in the
+    #  shell itself doesn't change the console's
+    # if the shell is busy with another command, the command runs with stream_once() instead
+    # raises IOError or OSError if the shell can't be started or the command can't be sent
+    #  to it, in which case the command hasn't run
+    def stream(self, command):
+        with self.lock:
+            if self.owner is not None:
+                if self.owner() is not None:
+                    return stream_once(command)
+                # the last command's generator was dropped before it started, so its output
+                #  was never read and would be taken for this command's
+                self.stop()
+            if not self.alive():
+                self.stop()
+                self.start()
+            script = ''
+            cwd = os.getcwd()
+            if cwd != self.cwd:
+                script += 'cd {:s}\n'.format(_quote(cwd))
+                self.cwd = cwd
+            script += "command eval {:s} </dev/null; printf '%s %d\\n' {:s} $?; printf '%s\\n' {:s} >&2\n".format(
+                _quote(command), self.token, self.token)
+            try:
+                self.process.stdin.write(script)
+                self.process.stdin.flush()
+            except (IOError, OSError):
+                self.stop()
+                raise
+            chunks = self._chunks()
+            self.owner = weakref.ref(chunks)
+        return chunks
+
+    # yields the command's output until both markers have arrived
+    # output that could be the start of a marker is held back until the next read shows
+    #  whether it is one
+    # if the shell dies first (for example, the command was "exit"), the status is the
+    #  shell's own exit status
+    def _chunks(self):
+        out_marker = '{:s} '.format(self.token)
+        err_marker = '{:s}\n'.format(self.token)
+        out_held = err_held = ''
+        status = None
+        err_done = False
+        finished = False
+        try:
+            for name, chunk in _read_pipes(self.process.stdout, self.process.stderr):
+                if name == 'out':
+                    out_held += chunk
+                    index = out_held.find(out_marker)
+                    rest = out_held[index + len(out_marker):]
+                    if index >= 0 and rest.endswith('\n') and rest[:-1].isdigit():
+                        status = int(rest)
+                        out_held = out_held[:index]
+                    keep = 0
+                    if status is None:
+                        keep = _marker_prefix(out_held, out_marker, 8)
+                    if keep < len(out_held):
+                        yield 'out', out_held[:len(out_held) - keep]
+                        out_held = out_held[len(out_held) - keep:]
+                else:
+                    err_held += chunk
+                    if err_held.endswith(err_marker):
+                        err_held = err_held[:-len(err_marker)]
+                        err_done = True
+                    keep = 0
+                    if not err_done:
+                        keep = _marker_prefix(err_held, err_marker, 0)
+                    if keep < len(err_held):
+                        yield 'err', err_held[:len(err_held) - keep]
+                        err_held = err_held[len(err_held) - keep:]
+                if status is not None and err_done:
+                    break
+            if out_held:
+                yield 'out', out_held
+            if err_held:
+                yield 'err', err_held
+            if status is None or not err_done:
+                self.process.wait()
+                status = self.process.returncode
+                self.stop()
+            finished = True
+            yield 'status', status
+        finally:
+            # closed early or interrupted, so the command is still running
+            if not finished:
+                self.stop()
+            self.owner = None
+
+# the console's long-lived shell, used by shell() and "%" lines once persistent_shell() is
+#  called. it's kept here rather than in default_functions.py, so reloading that file keeps
+#  the shell and whether it's enabled, and the exit handler is only registered once
+session = Shell_Session()
+atexit.register(session.stop)
+
+# runs command in a new shell and returns a generator of its output
+# the shell gets its own process group, so the whole pipeline can be killed at once
+def stream_once(command):
+    process = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=True,
+                    close_fds=True, preexec_fn=_child_setup)
+    # commands that read stdin get an empty input, as they did with communicate()
+    process.stdin.close()
+    return _process_chunks(process)
+
+def _process_chunks(process):
+    finished = False
+    try:
+        for output in _read_pipes(process.stdout, process.stderr):
+            yield output
+        process.wait()
+        finished = True
+        yield 'status', process.returncode
+    finally:
+        if not finished:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+# yields ('out', chunk) and ('err', chunk) pairs as they're read from two pipes, until both
+#  are closed
+def _read_pipes(stdout, stderr):
+    names = {stdout.fileno(): 'out', stderr.fileno(): 'err'}
+    open_fds = list(names)
+    while open_fds:
+        for fd in select.select(open_fds, [], [])[0]:
+            chunk = os.read(fd, 65536)
+            if chunk:
+                yield names[fd], chunk
+            else:
+                open_fds.remove(fd)
+
+# returns the length of the longest end of text that could be the start of marker, or the
+#  marker followed by up to digits digits
+def _marker_prefix(text, marker, digits):
+    index = text.find(marker[0], max(0, len(text) - len(marker) - digits))
+    while index >= 0:
+        end = text[index:]
+        if marker.startswith(end) or (end.startswith(marker) and end[len(marker):].isdigit()):
+            return len(end)
+        index = text.find(marker[0], index + 1)
+    return 0
+
+# collects output, keeping at most limit bytes of it
+# if there's more than that, the first and last halves of the limit are kept, and
+#  getvalue() notes how much was left out between them. a limit of None keeps everything
+class Head_Tail_Buffer():
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.total = 0
+        if limit is not None:
+            self.head_limit = limit // 2
+            self.tail_limit = limit - self.head_limit
+
+    def write(self, chunk):
+        self.total += len(chunk)
+        if self.limit is None:
+            self.head.append(chunk)
+            return
+        if self.head_size < self.head_limit:
+            part = chunk[:self.head_limit - self.head_size]
+            self.head.append(part)
+            self.head_size += len(part)
+            chunk = chunk[len(part):]
+        if chunk:
+            self.tail.append(chunk)
+            self.tail_size += len(chunk)
+            # drop whole chunks from the front while the rest still covers the tail
+            while self.tail_size - len(self.tail[0]) >= self.tail_limit:
+                self.tail_size -= len(self.tail.popleft())
+
+    def getvalue(self):
+        head = ''.join(self.head)
+        if self.limit is None:
+            return head
+        tail = ''.join(self.tail)
+        if self.tail_limit:
+            tail = tail[-self.tail_limit:]
+        else:
+            tail = ''
+        omitted = self.total - len(head) - len(tail)
+        if omitted:
+            return '{:s}\n... [{:d} bytes omitted] ...\n{:s}'.format(head, omitted, tail)
+        return head + tail
+
+# runs in each shell's process before it starts
+# python ignores SIGPIPE, which the shell would otherwise inherit, so commands like
+#  "yes | head" would complain about a broken pipe instead of just stopping
+def _child_setup():
+    os.setsid()
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+# quotes a string so the shell reads it as a single word
+def _quote(string):
+    return "'" + string.replace("'", "'\\''") + "'"
@@ -0,0 +1,158 @@
+# snapshots of the console's namespace, saved to a directory and restored in a later session
+# each variable is written to a file of its own, and the snapshot's index records a digest
+#  of each one's data. saving to the same directory again pickles every variable again,
+#  but only writes the files whose data changed and removes those of variables that are
+#  gone, so a save where one small variable changed doesn't rewrite every large one
+# large numpy arrays (of any dtype but object) are written in .npy format instead, and
+#  restored with numpy.load(mmap_mode='c'), which maps the file instead of reading it. the
+#  restore is zero-copy, pages are only read as they're used, and writing to the array
+#  changes the session's copy, not the snapshot. numpy is never imported here, only used if
+#  the namespace holds arrays or the snapshot does
+# anything that can't be pickled (modules, open files, functions defined at the prompt) is
+#  skipped and reported
+# files are written to a temporary name and renamed into place, the index last, so a save
+#  that's interrupted leaves the previous snapshot readable
+# only the files a snapshot's index lists are ever removed, and a directory that holds
+#  other files and no index isn't saved to, so saving to the wrong directory can't
+#  delete anything else
+import os, sys
+import re, types, hashlib, tempfile, cPickle
+
+# names of the files a snapshot writes: its variables' files and temporary files
+_snapshot_file = re.compile(r'^(\.|[0-9a-f]{20}\.(pkl|npy)$)')
+
+# whether value is a function or class that pickle can't find by name, like one defined at
+#  the prompt, whose module is the console's namespace
+def _unnamed(value):
+    if not isinstance(value, (types.FunctionType, types.ClassType, type)):
+        return False
+    module = sys.modules.get(getattr(value, '__module__', None) or '__builtin__')
+    return getattr(module, value.__name__, None) is not value
+
+class Snapshot():
+    # arrays smaller than mmap_threshold bytes are pickled like everything else
+    def __init__(self, path, mmap_threshold=65536):
+        self.path = path
+        self.mmap_threshold = mmap_threshold
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, 'index'))
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.path, 'index'), 'rb') as f:
+                return cPickle.load(f)
+        except IOError:
+            return {}
+
+    # writes a file in the snapshot, calling write with the file object to write to
+    def _write(self, filename, write):
+        fd, temp_path = tempfile.mkstemp(prefix='.', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.rename(temp_path, os.path.join(self.path, filename))
+        except:
+            os.remove(temp_path)
+            raise
+
+    # returns numpy if value is an array that's stored as a .npy file, otherwise None
+    def _array_module(self, value):
+        numpy = sys.modules.get('numpy')
+        if numpy is None or type(value) not in (numpy.ndarray, numpy.memmap):
+            return None
+        if value.dtype.hasobject or value.nbytes < self.mmap_threshold:
+            return None
+        return numpy
+
+    # saves the variables in namespace to the snapshot
+    # names is the names to save, leaving the rest of the snapshot as it was, or None to
+    #  save the whole namespace (except the names in exclude and names like __builtins__)
+    #  in place of whatever the snapshot held
+    # returns the names saved, the names whose files were written, the bytes written and
+    #  the reasons the rest were skipped
+    # raises IOError if the directory exists but isn't a snapshot
+    def save(self, namespace, names=None, exclude=()):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        elif not self.exists() and not all(_snapshot_file.match(filename) for filename in os.listdir(self.path)):
+            raise IOError('"{:s}" holds other files and isn\'t a snapshot, so nothing was saved. '
+                          'Save to a new or empty directory.'.format(self.path))
+        old_index = self._read_index()
+        index = {} if names is None else dict(old_index)
+        summary = {'saved': [], 'written': [], 'bytes': 0, 'skipped': {}}
+        if names is None:
+            names = sorted(name for name in namespace if name not in exclude and not name.startswith('__'))
+        for name in names:
+            if name not in namespace:
+                summary['skipped'][name] = 'not defined'
+                continue
+            value = namespace[name]
+            if isinstance(value, types.ModuleType):
+                summary['skipped'][name] = 'module'
+                continue
+            if _unnamed(value):
+                summary['skipped'][name] = 'defined at the prompt, so pickle can\'t find it by name'
+                continue
+            filename = hashlib.sha1(name).hexdigest()[:20]
+            numpy = self._array_module(value)
+            try:
+                if numpy is not None:
+                    data = numpy.ascontiguousarray(value)
+                    digest = hashlib.sha1('{:s} {!r}'.format(data.dtype.str, data.shape))
+                    digest.update(data.data)
+                    entry = {'file': filename + '.npy', 'kind': 'array', 'digest': digest.hexdigest()}
+                    size = data.nbytes
+                else:
+                    data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+                    entry = {'file': filename + '.pkl', 'kind': 'pickle', 'digest': hashlib.sha1(data).hexdigest()}
+                    size = len(data)
+            except Exception as e:
+                summary['skipped'][name] = '{:s}: {:s}'.format(type(e).__name__, str(e))
+                continue
+            if old_index.get(name) != entry or not os.path.exists(os.path.join(self.path, entry['file'])):
+                if numpy is not None:
+                    self._write(entry['file'], lambda f: numpy.save(f, data))
+                else:
+                    self._write(entry['file'], lambda f: f.write(data))
+                summary['written'].append(name)
+                summary['bytes'] += size
+            index[name] = entry
+            summary['saved'].append(name)
+        self._write('index', lambda f: cPickle.dump(index, f, cPickle.HIGHEST_PROTOCOL))
+        # files of variables that are no longer in the snapshot
+        kept = set(entry['file'] for entry in index.values())
+        for entry in old_index.values():
+            if entry['file'] not in kept:
+                try:
+                    os.remove(os.path.join(self.path, entry['file']))
+                except OSError:
+                    pass
+        return summary
+
+    # restores the variables in the snapshot into namespace, or only the ones in names
+    # returns the names restored, and the reasons the rest couldn't be
+    def restore(self, namespace, names=None):
+        if not self.exists():
+            raise IOError('There is no snapshot at "{:s}".'.format(self.path))
+        index = self._read_index()
+        summary = {'restored': [], 'failed': {}}
+        for name in (sorted(index) if names is None else names):
+            entry = index.get(name)
+            if entry is None:
+                summary['failed'][name] = 'not in the snapshot'
+                continue
+            path = os.path.join(self.path, entry['file'])
+            try:
+                if entry['kind'] == 'array':
+                    import numpy
+                    value = numpy.load(path, mmap_mode='c')
+                else:
+                    with open(path, 'rb') as f:
+                        value = cPickle.load(f)
+            except Exception as e:
+                summary['failed'][name] = '{:s}: {:s}'.format(type(e).__name__, str(e))
+                continue
+            namespace[name] = value
+            summary['restored'].append(name)
+        return summary
@@ -7,11 +7,12 @@ for tool in __builtin__.console_lib_tools:
 
 # modules used by this file
 from os import chdir
+import os, sys, imp
 import inspect
 from pprint import pprint
-from subprocess import Popen, CalledProcessError, PIPE
 
 # registers useful modules
+# these are bound lazily, so the ones that a session never uses are never imported
 useful_mods = ('os',
                'sys',
                'random',
@@ -22,31 +23,135 @@ useful_mods = ('os',
                'functools',
                'json'
                )
-register_modules(*useful_mods)
+register_modules(*useful_mods, lazy=True)
 
 # register the pprint function as a variable since we don't have access to its source
 register_variables(pprint=pprint)
 
-description = 'Execute arbitrary non-interactive commands in the shell. Also invoked by starting a line with "%", in which case the response is printed'
-detail_dict = {'Parameter:': {'<command>': 'A string to be executed in the shell'}, 'Returns:': {'<output>': 'The output, including errors, of the command executed, as a string'}}
+# the long-lived shell used by shell() and "%" lines once persistent_shell() is called
+# console_shell is only loaded once, so reloading this file keeps the same shell
+console_shell = sys.modules.get('console_shell')
+if console_shell is None:
+    console_shell = imp.load_source('console_shell', os.path.join(os.path.dirname(__file__), 'console_shell.py'))
+shell_session = console_shell.session
+
+# returns a generator of the output of a command, as described in console_shell.py
+# uses the persistent shell if it's enabled, or a new shell if it isn't or can't be used
+def _shell_chunks(command):
+    if shell_session.enabled:
+        try:
+            return shell_session.stream(command)
+        except (IOError, OSError):
+            # the shell couldn't be started or has died, so the command hasn't run yet
+            pass
+    return console_shell.stream_once(command)
+
+description = 'Execute arbitrary non-interactive commands in the shell. Also invoked by starting a line with "%", in which case the output is printed as it arrives'
+detail_dict = {'Parameters:': {'<command>': 'A string to be executed in the shell',
+                               '<limit>': 'Optional. The most bytes of output and of errors to keep. If there are more, only the first and last halves of the limit are kept. Default is no limit.'},
+               'Returns:': {'<output>': 'The output, including errors, of the command executed, as a string'}}
 # executes arbitrary non-interactive commands in the shell
-# also called by starting an input line with '%', in which case the response is printed
+# the exit status of the last command is kept in shell.returncode
 @register_function(description, detail_dict=detail_dict)
-def shell(command):
+def shell(command, limit=None):
     try:
-        pipe = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=True)
-        response = pipe.communicate()
-        resp = response[0]
-        if response[1]:
+        out = console_shell.Head_Tail_Buffer(limit)
+        err = console_shell.Head_Tail_Buffer(limit)
+        for name, output in _shell_chunks(command):
+            if name == 'out':
+                out.write(output)
+            elif name == 'err':
+                err.write(output)
+            else:
+                shell.returncode = output
+        resp = out.getvalue()
+        if err.total:
             resp += '"{:s}" produced the following error:\n'.format(command)
-            resp += str(response[1])
-    except CalledProcessError as e:
-        resp = '"{:s}" produced the following error:\n'.format(e.cmd)
-        resp += str(e.output)
+            resp += err.getvalue()
     except Exception as e:
         resp = str(e)
-    finally:
-        return resp.rstrip()
+    # a Ctrl-C while the command runs kills it, and is left to interrupt the console as usual
+    return resp.rstrip()
+shell.returncode = None
+
+description = 'Execute a command in the shell, yielding its output as it arrives instead of waiting for it to finish. Errors are printed as they arrive.'
+detail_dict = {'Parameters:': {'<command>': 'A string to be executed in the shell',
+                               '<lines>': 'Optional. If True, yields one line at a time, including the line break. Otherwise, yields chunks of output as they are read. Default is True.'},
+               'Yields:': {'<output>': 'The output of the command, as strings'}}
+# the exit status is kept in shell.returncode once the generator is exhausted
+# stopping early, or a Ctrl-C while waiting for output, kills the command
+@register_function(description, detail_dict=detail_dict)
+def shell_stream(command, lines=True):
+    partial = ''
+    for name, output in _shell_chunks(command):
+        if name == 'err':
+            sys.stderr.write(output)
+        elif name == 'status':
+            shell.returncode = output
+        elif not lines:
+            yield output
+        else:
+            output = partial + output
+            start = 0
+            end = output.find('\n') + 1
+            while end:
+                yield output[start:end]
+                start = end
+                end = output.find('\n', start) + 1
+            partial = output[start:]
+    if partial:
+        yield partial
+
+description = 'Execute a command in the shell, printing its output and errors as they arrive. Invoked by starting a line with "%".'
+detail_dict = {'Parameter:': {'<command>': 'A string to be executed in the shell'}}
+# a Ctrl-C kills the command
+@register_function(description, detail_dict=detail_dict)
+def print_shell(command):
+    for name, output in _shell_chunks(command):
+        if name == 'out':
+            sys.stdout.write(output)
+            sys.stdout.flush()
+        elif name == 'err':
+            sys.stderr.write(output)
+        else:
+            shell.returncode = output
+
+description = 'Run shell() and "%" lines in one long-lived shell, instead of a new shell for each command. Commands start faster, and "cd", "export" and aliases carry over between them. The shell starts in the console\'s working directory and follows it when it changes.'
+detail_dict = {'Parameter:': {'<enabled>': 'Optional. False to go back to a new shell for each command. Default is True.'}}
+@register_function(description, detail_dict=detail_dict)
+def persistent_shell(enabled=True):
+    shell_session.enabled = enabled
+    if not enabled:
+        shell_session.stop()
+
+# pool of workers and the chunking and progress display used by pmap() and pfilter()
+console_parallel = imp.load_source('console_parallel', os.path.join(os.path.dirname(__file__), 'console_parallel.py'))
+
+parallel_parameters = {'<function>': 'The function to call with each item. Functions and lambdas defined at the prompt work with processes too, since the workers are forked copies of the console and only the items and results are pickled.',
+                       '<iterable>': 'The items, which can be a generator. They are read a few chunks at a time, as the workers need them.',
+                       '<workers>': 'Optional. The number of workers. Default is the number of cores.',
+                       '<threads>': 'Optional. If True, runs on threads in the console instead of processes, which is only faster for functions that spend their time in I/O or in code that releases the GIL, like numpy. Default is False.',
+                       '<ordered>': 'Optional. If False, results come back as each chunk finishes instead of in the order of the items. Default is True.',
+                       '<stream>': 'Optional. If True, returns a generator that yields results as they arrive instead of a list. Default is False.',
+                       '<chunk_size>': 'Optional. The number of items sent to a worker at a time. Default is to grow the chunks until each takes about 50ms.'}
+
+description = 'Call a function with every item of an iterable, on a pool of worker processes or threads, showing progress on the prompt line. Ctrl-C stops the workers.'
+detail_dict = {'Parameters:': parallel_parameters,
+               'Returns:': {'<results>': 'A list of the results, or a generator of them if stream is True'}}
+@register_function(description, detail_dict=detail_dict)
+def pmap(function, iterable, workers=None, threads=False, ordered=True, stream=False, chunk_size=None):
+    results = console_parallel.imap(function, iterable, workers=workers, threads=threads, chunk_size=chunk_size,
+                                    ordered=ordered, stream=stream, label='pmap')
+    return results if stream else list(results)
+
+description = 'Keep the items of an iterable for which a function returns true, calling it on a pool of worker processes or threads, showing progress on the prompt line. Ctrl-C stops the workers.'
+detail_dict = {'Parameters:': parallel_parameters,
+               'Returns:': {'<items>': 'A list of the items kept, or a generator of them if stream is True'}}
+@register_function(description, detail_dict=detail_dict)
+def pfilter(function, iterable, workers=None, threads=False, ordered=True, stream=False, chunk_size=None):
+    items = console_parallel.imap(function, iterable, keep=True, workers=workers, threads=threads, chunk_size=chunk_size,
+                                  ordered=ordered, stream=stream, label='pfilter')
+    return items if stream else list(items)
 
 description = 'Pretty print a value.'
 detail_dict = ['Usage: "pp <value>"', {'Parameter:': {'<value>': 'A value or object to be pretty printed, as with pprint() from the pprint module.'}}]
@@ -62,7 +167,8 @@ def quit_console(*args):
 
 description = 'Change the current working directory. Takes an absolute or relative path as a parameter.'
 detail_dict = ['Usage: "cd <path>"', {'Parameter:': {'<path>': 'Absolute or relative path to which to change the current working directory.'}}]
-@register_command('cd', invocation='change_directory("{:s}")', description=description, detail_dict=detail_dict)
+@register_command('cd', invocation='change_directory("{:s}")', description=description, detail_dict=detail_dict,
+                  completion='path')
 def change_directory(path):
     os.chdir(path)
 
@@ -78,8 +184,8 @@ detail_dict = ['Usage: "help[ <query 1>[ <query 2>[ <query 3>...]]]"',
                {'Parameters:':
                     {'<query>':
                         "A built-in function or command you'd like more info on. Any number of these can be included. If none, prints help for all functions and commands with help entries."}}]
-@register_command('help', description='Print this message ;). Also optionally can be used for information on certain commands', detail_dict=detail_dict, invocation='print_help("{:s}")')
-@register_command('h', help=False, invocation='print_help("{:s}")')
+@register_command('help', description='Print this message ;). Also optionally can be used for information on certain commands', detail_dict=detail_dict, invocation='print_help("{:s}")', completion='help')
+@register_command('h', help=False, invocation='print_help("{:s}")', completion='help')
 def print_help(*args):
     if not args:
         output = 'This is the extensible interactive console. These are the special commands and\n objects that have descriptions defined.\n\n'
@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
 
-tar cJf pycon.tar.xz python_console.py console_lib_tools.py default_functions.py custom_functions.py runscript.sh
-rm python_console.py console_lib_tools.py default_functions.py custom_functions.py runscript.sh
+tar cJf pycon.tar.xz python_console.py console_lib_tools.py console_cache.py console_log.py console_shell.py console_completion.py console_history.py console_session_log.py console_jobs.py console_server.py console_client.py console_reload.py console_snapshot.py console_memory.py console_parallel.py console_async.py default_functions.py custom_functions.py runscript.sh
+rm python_console.py console_lib_tools.py console_cache.py console_log.py console_shell.py console_completion.py console_history.py console_session_log.py console_jobs.py console_server.py console_client.py console_reload.py console_snapshot.py console_memory.py console_parallel.py console_async.py default_functions.py custom_functions.py runscript.sh
 rm $0
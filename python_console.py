@@ -3,36 +3,145 @@
 # imports only available in this file
 import os, sys
 import time, datetime
-import functools
+import re, json, shlex, heapq, calendar, functools, resource
+from collections import OrderedDict, deque
 from StringIO import StringIO
+import tempfile
 from code import softspace, InteractiveConsole
 from codeop import CommandCompiler
-import readline, rlcompleter, atexit, types, subprocess, argparse, imp, __builtin__
+import atexit, types, tokenize, argparse, imp, signal, gc, __builtin__
+
+# used by the --profile-startup mode to time each phase of startup
+# phases are timed from the end of the previous one, so they account for all of the time
+#  between the start of this script and the first prompt
+class Startup_Profiler():
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.start = time.time()
+        self.last = self.start
+        self.phases = []
+
+    # ends the current phase, naming it name
+    # details is a list of (label, timings) pairs, where timings is a list of (name, seconds)
+    def phase(self, name, details=()):
+        now = time.time()
+        if self.enabled:
+            self.phases.append((name, now - self.last, details))
+        self.last = now
+
+    def report(self, stream):
+        if not self.enabled:
+            return
+        stream.write('Startup profile (seconds):\n')
+        for name, seconds, details in self.phases:
+            stream.write('  {:<44s}{:>9.4f}\n'.format(name, seconds))
+            for label, timings in details:
+                stream.write('    register_modules() at {:s}\n'.format(label))
+                for mod, mod_seconds in timings:
+                    stream.write('      {:<40s}{:>9.4f}\n'.format(mod, mod_seconds))
+        stream.write('  {:<44s}{:>9.4f}\n'.format('total', self.last - self.start))
+
+# the flag is checked before the argument parser exists, since the parser is only built
+#  after the function files it's timing have been loaded
+profiler = Startup_Profiler('--profile-startup' in sys.argv)
+# the same goes for the server mode, which stops partway through startup to serve sessions
+server_mode = '--server' in sys.argv
+
+# loads a function file, recording its cost and the cost of its module registrations
+def load_function_file(name, path):
+    if profiler.enabled:
+        lib_tools._import_timings = []
+    try:
+        return startup_cache.load_source(name, path)
+    finally:
+        profiler.phase('load {:s}'.format(os.path.basename(path)), lib_tools._import_timings or ())
+        lib_tools._import_timings = None
+
+# loads one of the console's own modules, reusing it if the server has already loaded it
+def load_console_module(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    return imp.load_source(name, os.path.join(file_dir, name + '.py'))
 
 # load the library tools used by external function definitions
 file_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir))
-__builtin__.console_lib_tools = imp.load_source('console_lib_tools', os.path.join(file_dir, 'console_lib_tools.py')).export_dict
+lib_tools = imp.load_source('console_lib_tools', os.path.join(file_dir, 'console_lib_tools.py'))
+__builtin__.console_lib_tools = lib_tools.export_dict
+profiler.phase('load console_lib_tools.py')
+
+# load the cache of project roots and compiled function files from previous launches
+console_cache = imp.load_source('console_cache', os.path.join(file_dir, 'console_cache.py'))
+startup_cache = console_cache.Startup_Cache(os.path.join(file_dir, 'startup_cache'))
+profiler.phase('load startup cache')
+
+# keeps track of what each function file registers, so the reload command can run a file
+#  again. later files in the order take precedence over earlier ones
+console_reload = load_console_module('console_reload')
+function_files = console_reload.Function_Files(lib_tools, load_function_file,
+                                               ('default_functions', 'custom_functions', 'project_functions'))
 
 # find a project-specific console module
-# executes "git rev-parse --show-toplevel" to find the project root
+# walks up from the working directory to the nearest directory containing .git
 #  then looks for a file called console_lib.py
-try:
-    resp = subprocess.check_output("git rev-parse --show-toplevel", stderr=open(os.devnull, 'w'), shell=True)
-    resp = resp.rstrip()
-except subprocess.CalledProcessError:
-    project_functions = None
-except Exception as e:
-    raise e
-else:
-    if os.path.isdir(resp):
-        project_functions = imp.load_source('project_functions', os.path.join(resp, 'console_lib.py'))
+def load_project_functions():
+    project_root = startup_cache.project_root(os.getcwd())
+    profiler.phase('find project root')
+    if project_root and os.path.isfile(os.path.join(project_root, 'console_lib.py')):
+        return function_files.load('project_functions', os.path.join(project_root, 'console_lib.py'))
+    return None
+
+# the server loads each session's project module once it knows the session's directory
+project_functions = None
+if not server_mode:
+    project_functions = load_project_functions()
 
 # import global default and custom functions
-default_functions = imp.load_source('default_functions', os.path.join(file_dir, 'default_functions.py'))
-try:
-    custom_functions = imp.load_source('custom_functions', os.path.join(file_dir, 'custom_functions.py'))
-except IOError:
-    pass
+def load_global_functions():
+    global default_functions, custom_functions
+    default_functions = function_files.load('default_functions', os.path.join(file_dir, 'default_functions.py'))
+    try:
+        custom_functions = function_files.load('custom_functions', os.path.join(file_dir, 'custom_functions.py'))
+    except IOError:
+        pass
+
+load_global_functions()
+
+# socket of the server that --server starts and the pycon command's client connects to
+server_socket = os.path.join(file_dir, 'server.sock')
+if '--stop_server' in sys.argv:
+    console_client = imp.load_source('console_client', os.path.join(file_dir, 'console_client.py'))
+    sys.exit(console_client.main(['--stop_server']))
+
+# in server mode, everything loaded so far is kept warm in the server, and serve() only
+#  returns in a new session's process, which carries on with the rest of startup
+# modules registered lazily and the console modules that every session loads are imported
+#  up front, since the server only imports them once for every session
+if server_mode:
+    for value in lib_tools.export_dict['export_dict'].values():
+        if isinstance(value, lib_tools.Lazy_Module):
+            try:
+                value._load()
+            except Exception:
+                pass
+    for name in ('console_history', 'console_log', 'console_session_log', 'console_jobs', 'console_completion',
+                 'console_snapshot', 'console_memory', 'console_async'):
+        load_console_module(name)
+    startup_cache.save()
+    console_server = imp.load_source('console_server', os.path.join(file_dir, 'console_server.py'))
+    console_server.serve(server_socket, file_dir, [sys.executable, os.path.abspath(__file__), '--server'])
+    profiler = Startup_Profiler('--profile-startup' in sys.argv)
+    project_functions = load_project_functions()
+    # without the server the project's file runs first, so whatever it sets up at load time,
+    #  like set_lazy_modules(), applies to the global files too; they're run again after it
+    #  to keep that order, which is cheap since the server already imported what they import
+    if project_functions is not None:
+        load_global_functions()
+        profiler.phase('reload global functions')
+startup_cache.save()
+profiler.phase('save startup cache')
+
+# imported after the server forks a session, so readline starts with the session's terminal
+import readline
 
 # inherit the argument parser from project_functions if possible
 try:
@@ -72,27 +181,64 @@ def _file_check(f, permission='r', exists=True, create=True):
 parser.add_argument('--log', type=functools.partial(_file_check, permission='w', exists=False), default=None,
                     metavar='<log file>', help='Path to a log file. Default is "test_suite.log".')
 parser.add_argument('--restart_log', action='store_true', help='Include to wipe the log before saving a log.')
+parser.add_argument('--sync_log', action='store_true', help='Include to write the log as output happens, instead of in batches from a background thread.')
+parser.add_argument('--log_max_bytes', type=int, default=0, metavar='<bytes>', help='Rotate the log when it would grow past this size. Default is 0, which never rotates by size.')
+parser.add_argument('--log_rotate_interval', type=float, default=0, metavar='<seconds>', help='Rotate the log when it has been written to for this long. Default is 0, which never rotates by age.')
+parser.add_argument('--log_backups', type=int, default=5, metavar='<count>', help='Number of rotated logs to keep, as <log file>.1, <log file>.2, etc. Default is 5.')
+parser.add_argument('--log_compress', action='store_true', help='Include to gzip rotated logs.')
+parser.add_argument('--no_structured_log', action='store_true', help='Include to skip writing each statement to the structured log, <log file>.jsonl, that the logsearch command searches.')
+parser.add_argument('--structured_log_limit', type=int, default=65536, metavar='<bytes>', help="Most of each statement's output and of its errors kept in the structured log. Default is 65536.")
+parser.add_argument('--job_threads', type=int, default=4, metavar='<threads>', help='Number of thread jobs (started with "bg" or a trailing "&") that can run at once. Default is 4.')
+parser.add_argument('--job_output_limit', type=int, default=1048576, metavar='<bytes>', help="Most of each background job's output that's kept. Default is 1048576.")
+parser.add_argument('--code_cache_size', type=int, default=512, metavar='<entries>', help='Number of compiled input lines to keep for reuse. Default is 512. 0 disables the cache.')
+parser.add_argument('--stats_size', type=int, default=10000, metavar='<statements>', help='Number of statements to keep timings for, for the stats command. Default is 10000.')
+parser.add_argument('--trace_memory', action='store_true', help='Include to measure memory use with tracemalloc, if it is installed, instead of peak resident set size, and to record the lines that allocated the memory each statement kept, for memdiff.')
+parser.add_argument('--history_size', type=int, default=50000, metavar='<entries>', help='Number of distinct entries the history file is compacted to once it holds twice as many. Default is 50000.')
+parser.add_argument('--history_load', type=int, default=1000, metavar='<entries>', help='Number of the most recent history entries available to readline at startup. Default is 1000. Older entries can be found with the "history" command.')
+parser.add_argument('--batch', type=lambda path: path if path == '-' else _file_check(path), default=None, metavar='<file>',
+                    help='Run each line of a file, or of stdin if "-", as if it had been entered at the prompt, then exit. There are no prompts, readline or completion, and output is buffered. Exits with 1 if any statement failed.')
+parser.add_argument('--batch_format', choices=('text', 'jsonl'), default='text', help='What --batch writes to stdout: each statement\'s output as it would have been printed ("text", the default), or a line of JSON for each statement with its input, output, errors, whether it failed and its timings ("jsonl").')
+parser.add_argument('--continue_on_error', action='store_true', help='Include to keep running --batch input after a statement fails, instead of stopping at the first one.')
+parser.add_argument('--auto_reload', action='store_true', help='Include to check before each prompt whether the default, custom or project function files have changed, and reload the ones that have, as the "reload" command does.')
+parser.add_argument('--auto_restore', action='store_true', help='Include to restore the namespace snapshot saved with the "save" command, <log file>.snapshot, at startup.')
+parser.add_argument('--server', action='store_true', help='Include to start a server in the background that keeps the function files loaded, so the pycon command starts new sessions from it in milliseconds. Sessions still load the project\'s console_lib.py and take their own arguments. The server restarts itself when the console\'s files change.')
+parser.add_argument('--stop_server', action='store_true', help='Include to stop the server started with --server.')
 parser.add_argument('--uninstall', action='help', help="Uninstall pycon, but retain custom functions, history, and default log. Must be the first argument.")
+parser.add_argument('--profile-startup', action='store_true', help='Include to print how long each phase of startup took before the first prompt.')
 parser.add_argument('--purge', action='help', help="Purge pycon. Can't be undone. Must be the first argument.")
 parser.add_argument('-h', '--help', action='help', help='Show this help message and exit')
 
 args = parser.parse_known_args()[0]
+profiler.phase('parse arguments')
 
 # class used to wrap stdout and stderror to provide logging
+# capture is an extra file-like object that's written to while it's set, used to record
+#  each statement's output in the structured log
 class Out_Stream_Logger():
     def __init__(self, inner, log):
         self.inner = inner
         self.log = log
+        self.capture = None
 
     def write(self, string):
-        self.inner.write(str(string))
-        self.log.write(str(string))
+        string = str(string)
+        self.inner.write(string)
+        self.log.write(string)
+        if self.capture is not None:
+            self.capture.write(string)
 
     def writelines(self, sequence):
-        self.inner.writelines(str(s) for s in sequence)
-        self.log.writelines(str(s) for s in sequence)
+        for s in sequence:
+            self.write(s)
 
+    # only flushes the terminal, since the log is flushed by its own writer
+    def flush(self):
+        self.inner.flush()
+
+    # a caller that wants the file descriptor writes to it directly, so anything buffered
+    #  is written first to keep the output in order
     def fileno(self):
+        self.inner.flush()
         return self.inner.fileno()
 
 if args.log:
@@ -101,24 +247,51 @@ else:
     log_file = _file_check(os.path.join(file_dir, 'default_output.log'), permission='w', exists=False)
 
 # logic for loading and saving the command history
+# each line entered is appended to the history file as it's entered (see raw_input()), and
+#  only the most recent lines are loaded into readline
 hist = _file_check(log_file + 'hist', permission='w', exists=False)
+console_history = load_console_module('console_history')
+history_store = console_history.History_Store(hist, size=args.history_size)
 
-def save_history(historyPath=hist):
-    import readline
-    readline.write_history_file(hist)
-
+structured_log_file = log_file + '.jsonl'
+# default directory for the save and restore commands
+snapshot_dir = log_file + '.snapshot'
 if args.restart_log:
-    for filename in (log_file, hist):
+    for filename in (log_file, hist, structured_log_file, structured_log_file + '.idx'):
         with open(filename, 'w') as f:
             f.write('')
-else:
-    readline.read_history_file(hist)
-
-atexit.register(save_history)
+elif not args.batch:
+    for entry in history_store.recent(args.history_load):
+        readline.add_history(entry)
+    history_store.compact_in_background()
+profiler.phase('load history')
 
 # set up the log file object and bind it as an extra output to stderr
-log_file_obj = open(log_file, 'a')
-sys.stderr = Out_Stream_Logger(sys.__stderr__, log_file_obj)
+# the log is closed last at exit, so that everything written before then reaches it
+console_log = load_console_module('console_log')
+log_file_obj = console_log.Log_Writer(log_file, background=not args.sync_log, max_bytes=args.log_max_bytes,
+                                      interval=args.log_rotate_interval, backups=args.log_backups, compress=args.log_compress)
+atexit.register(log_file_obj.close)
+stderr_logger = Out_Stream_Logger(sys.__stderr__, log_file_obj)
+sys.stderr = stderr_logger
+# bound to stdout by the console while each statement runs
+stdout_logger = Out_Stream_Logger(sys.__stdout__, log_file_obj)
+
+# set up the structured log, which records each statement's input and output separately
+console_session_log = load_console_module('console_session_log')
+session_log = None
+if not args.no_structured_log:
+    session_log = console_session_log.Session_Log(structured_log_file, (stdout_logger, stderr_logger),
+                                                  limit=args.structured_log_limit)
+    atexit.register(session_log.close)
+
+# exit normally when the terminal closes or the console is killed, so that the atexit
+#  handlers still flush the log
+def _exit_on_signal(signum, frame):
+    sys.exit(128 + signum)
+for signum in (signal.SIGTERM, signal.SIGHUP):
+    signal.signal(signum, _exit_on_signal)
+profiler.phase('open log')
 
 # used to provide timestamps on the prompt
 class Prompt():
@@ -140,6 +313,170 @@ sys.ps2 = Prompt('. ')
 # define the starting timestamp
 formatted_init = datetime.datetime.utcfromtimestamp(sys.ps1.init_time).strftime('%Y-%m-%d %H:%M:%S')
 banner = 'Start time is {:d}: {:s} UTC'.format(sys.ps1.init_time, formatted_init)
+if session_log is not None:
+    banner += '\nSession id is {:s}'.format(session_log.session)
+
+# namespace that special commands and "%" lines run in
+# it's passed to exec as the statement's locals, with the console's namespace as its
+#  globals, so a name lookup checks the special command functions first and then falls
+#  through to the console's namespace without either of them being copied. assignments
+#  are written straight through to the console's namespace
+class Command_Namespace(object):
+    def __init__(self, namespace, functions):
+        self.namespace = namespace
+        self.functions = functions
+
+    def __getitem__(self, name):
+        return self.functions[name]
+
+    def __setitem__(self, name, value):
+        self.namespace[name] = value
+
+    def __delitem__(self, name):
+        del self.namespace[name]
+
+# least recently used cache of compiled code, so repeated input isn't compiled again
+# a maxsize of 0 disables caching
+class Code_Cache():
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # returns the cached code for key, or calls compile_func(*args) to compile it
+    # a result of None (incomplete input) isn't cached, and neither are errors
+    def get(self, key, compile_func, *args):
+        try:
+            code = self.entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            code = compile_func(*args)
+            if code is None or not self.maxsize:
+                return code
+            if len(self.entries) >= self.maxsize:
+                self.entries.popitem(last=False)
+        self.entries[key] = code
+        return code
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'size': len(self.entries)}
+
+# records how long each statement took to run, how much it raised peak memory use and how
+#  much memory it allocated and kept
+# cpu time is the user and system time of the whole process, so it includes any other
+#  threads that were running at the time
+# memory is measured with tracemalloc if trace_memory is set and it can be imported (it
+#  isn't part of python 2's standard library), otherwise as the rise in peak resident set
+#  size, which is only nonzero for a statement that used more memory than any before it
+# with tracemalloc, each statement also records the lines that allocated the most memory
+#  that it kept, from snapshots taken before and after it
+class Statement_Stats():
+    def __init__(self, size, trace_memory=False):
+        self.records = deque(maxlen=size)
+        self.memory_reader = console_memory.Memory_Reader()
+        self.tracemalloc = None
+        if trace_memory:
+            try:
+                import tracemalloc
+            except ImportError:
+                sys.__stderr__.write('tracemalloc is not installed, so peak resident set size is measured instead.\n')
+            else:
+                tracemalloc.start()
+                self.tracemalloc = tracemalloc
+
+    # returns the peak memory use so far, in bytes
+    def _peak(self):
+        if self.tracemalloc:
+            return self.tracemalloc.get_traced_memory()[1]
+        # kilobytes, except on OS X
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024
+        return peak
+
+    # returns the starting point of a statement, to be passed to finish()
+    def start(self):
+        memory = self._peak()
+        snapshot = None
+        if self.tracemalloc:
+            snapshot = self.tracemalloc.take_snapshot()
+            if hasattr(self.tracemalloc, 'reset_peak'):
+                self.tracemalloc.reset_peak()
+                memory = self.tracemalloc.get_traced_memory()[0]
+        times = os.times()
+        return time.time(), times[0] + times[1], memory, self.memory_reader.allocated(), snapshot
+
+    # records the statement that began at start and returns its record
+    def finish(self, start, source):
+        times = os.times()
+        record = {'time': int(start[0]) - sys.ps1.init_time,
+                  'source': source,
+                  'wall': time.time() - start[0],
+                  'cpu': times[0] + times[1] - start[1],
+                  'memory': max(0, self._peak() - start[2]),
+                  'allocated': self.memory_reader.allocated() - start[3]}
+        if start[4] is not None:
+            differences = self.tracemalloc.take_snapshot().compare_to(start[4], 'lineno')
+            record['where'] = ['{:s}:{:d} {:s}'.format(difference.traceback[0].filename, difference.traceback[0].lineno,
+                                                       _format_change(difference.size_diff))
+                               for difference in differences[:3] if difference.size_diff > 0]
+        self.records.append(record)
+        return record
+
+# formats a duration with a unit that suits it, like timeit does
+def _format_seconds(seconds):
+    for unit, scale in (('s', 1.0), ('ms', 1e3), ('us', 1e6)):
+        if seconds >= 1.0 / scale:
+            return '{:.3g} {:s}'.format(seconds * scale, unit)
+    return '{:.3g} ns'.format(seconds * 1e9)
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{:d} {:s}'.format(size, unit)
+        size //= 1024
+    return '{:d} GB'.format(size)
+
+def _format_change(size):
+    return ('+' if size >= 0 else '-') + _format_bytes(abs(size))
+
+# invocations that just pass the command's arguments to a function as a string
+# these commands are dispatched by calling the function directly, instead of formatting
+#  the invocation and compiling the result
+_string_invocation = re.compile(r'''^\s*([A-Za-z_]\w*)\((["'])\{:s\}\2\)\s*$''')
+
+# "<target> = await <expression>", where the target is a name, an attribute or several of
+#  them separated by commas
+_await_assignment = re.compile(r'^\s*([A-Za-z_][\w.]*(?:\s*,\s*[A-Za-z_][\w.]*)*)\s*=\s*await\s+(\S.*?)\s*$', re.S)
+
+# returns record as a line of JSON for batch mode, with its strings decoded as utf-8
+def _json_line(record):
+    for key in record:
+        if isinstance(record[key], str):
+            record[key] = record[key].decode('utf-8', 'replace')
+    return json.dumps(record) + '\n'
+
+# returns the python source before a trailing "&" that marks code as a background job, or
+#  None if there isn't one. an "&" in a string or a comment doesn't count, and neither does
+#  one in code that can't be tokenized yet, like an unclosed bracket
+def _job_marker(code):
+    last = None
+    try:
+        for token in tokenize.generate_tokens(StringIO(code).readline):
+            if token[0] not in _insignificant_tokens:
+                last = token
+    except (tokenize.TokenError, IndentationError):
+        return None
+    if last is None or last[0] != tokenize.OP or last[1] != '&':
+        return None
+    row, column = last[2]
+    lines = code.splitlines(True)
+    return ''.join(lines[:row - 1]) + lines[row - 1][:column]
+
+_insignificant_tokens = (tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT,
+                         tokenize.ENDMARKER)
 
 class LoggedConsole(InteractiveConsole):
     def __init__(self, locals=None, special_commands={}):
@@ -154,13 +491,29 @@ class LoggedConsole(InteractiveConsole):
         InteractiveConsole.__init__(self, locals)
         self.special_commands = special_commands
         self.compile = CommandCompiler()
+        self.code_cache = Code_Cache(args.code_cache_size)
+        self.statement_stats = Statement_Stats(args.stats_size, args.trace_memory)
+        self.source = ''
+        # whether the current statement failed and its record from statement_stats, for
+        #  batch mode
+        self.failed = False
+        self.record = None
+        self.interactive = sys.stdin.isatty() and sys.__stdout__.isatty()
+        self.command_namespace = Command_Namespace(self.locals, {})
+        # set once readline is set up, told about each statement that runs
+        self.completer = None
+        self.update_special_commands()
 
     def runsource(self, source, filename="<input>", symbol="single"):
         try:
             code, context = self.interpert_source(source, filename, symbol)
         except (OverflowError, SyntaxError, ValueError):
             # Case 1
+            if session_log is not None:
+                session_log.start()
             self.showsyntaxerror(filename)
+            if session_log is not None:
+                session_log.finish(source)
             return False
 
         if code is None:
@@ -168,15 +521,25 @@ class LoggedConsole(InteractiveConsole):
             return True
 
         # Case 3
+        self.source = source
         self.runcode(code, context=context)
         return False
 
+    # context is an extra namespace checked before the console's own, if any
+    # code can also be a function that takes no arguments, which is called instead
+    # the statement's timings are written to the log after its output
     def runcode(self, code, context=None):
-        if not context:
+        if context is None or context is self.locals:
             context = self.locals
+        start = self.statement_stats.start()
+        if session_log is not None:
+            session_log.start()
         try:
-            sys.stdout = Out_Stream_Logger(sys.__stdout__, log_file_obj)
-            exec code in context
+            stdout_router.target = stdout_logger
+            if callable(code):
+                code()
+            else:
+                exec code in self.locals, context
         except SystemExit:
             raise
         except:
@@ -185,62 +548,776 @@ class LoggedConsole(InteractiveConsole):
             if softspace(sys.stdout, 0):
                 print
         finally:
-            sys.stdout = sys.__stdout__
+            stdout_router.target = sys.__stdout__
+            record = self.statement_stats.finish(start, self.source)
+            self.record = record
+            record['names'] = getattr(code, 'co_names', ())
+            log_file_obj.write('[stats] wall {:s}, cpu {:s}, peak memory +{:s}\n'.format(
+                _format_seconds(record['wall']), _format_seconds(record['cpu']), _format_bytes(record['memory'])))
+            log_file_obj.submit()
+            if session_log is not None:
+                session_log.finish(self.source, record)
+            memory_sizes.note_code(code)
+            if self.completer is not None:
+                self.completer.note_code(code)
+
+    # output written before an error is flushed first, so the two stay in order when
+    #  output is buffered
+    def showtraceback(self):
+        self.failed = True
+        stdout_logger.flush()
+        InteractiveConsole.showtraceback(self)
+
+    def showsyntaxerror(self, filename=None):
+        self.failed = True
+        stdout_logger.flush()
+        InteractiveConsole.showsyntaxerror(self, filename)
+
+    # runs each of lines as if it had been entered at the prompt, through push() and so
+    #  interpert_source(), and returns the exit status: 1 if any statement failed, else 0
+    # there are no prompts or readline, and stdout is written through a large buffer
+    #  instead of a line at a time. statements end where they would at the prompt, so a
+    #  compound statement needs a blank line after it
+    # if structured is set, each statement's output and errors are collected instead of
+    #  printed, and a line of JSON is written to stdout for each statement. they're
+    #  collected in unbuffered temporary files rather than in memory, so commands that write
+    #  to sys.stdout's file descriptor work as they do at the prompt
+    # jobs the input started are waited for at the end, since exiting would drop them, and
+    #  reported as the wait command reports them, or as a line of JSON each
+    def run_batch(self, lines, stop_on_error=True, structured=False):
+        inner = (stdout_logger.inner, stderr_logger.inner)
+        output = os.fdopen(os.dup(sys.__stdout__.fileno()), 'w', 65536)
+        stdout_logger.inner = output
+        captures = None
+        if structured:
+            captures = (tempfile.TemporaryFile(bufsize=0), tempfile.TemporaryFile(bufsize=0))
+        status = 0
+        try:
+            for line in lines:
+                failed = self._batch_line(line.rstrip('\r\n'), output, captures)
+                if failed:
+                    status = 1
+                    if stop_on_error:
+                        break
+            else:
+                # a statement still incomplete at the end is ended as a blank line would end it
+                if self.buffer and self._batch_line('', output, captures, last=True):
+                    status = 1
+            if self._finish_batch_jobs(output, structured):
+                status = 1
+            return status
+        finally:
+            stdout_logger.inner, stderr_logger.inner = inner
+            output.close()
+            for capture in captures or ():
+                capture.close()
+
+    # pushes a line of batch input, and returns whether the statement it ended failed, or
+    #  None if the statement continues on the next line
+    # captures is the pair of files that the statement's output and errors are collected in
+    #  for a line of JSON, or None if they're printed
+    # last is whether there's no more input, in which case a statement that still isn't
+    #  complete is a syntax error
+    def _batch_line(self, line, output, captures, last=False):
+        prompt = sys.ps2 if self.buffer else sys.ps1
+        log_file_obj.write(prompt.suffix + line + '\n')
+        if not self.buffer:
+            self.failed = False
+            self.record = None
+            if captures:
+                for capture in captures:
+                    capture.seek(0)
+                    capture.truncate()
+                stdout_logger.inner, stderr_logger.inner = captures
+        source = '\n'.join(self.buffer + [line])
+        if self.push(line):
+            if not last:
+                return None
+            self.resetbuffer()
+            try:
+                compile(source, '<input>', 'exec')
+            except (OverflowError, SyntaxError, ValueError):
+                self.showsyntaxerror('<input>')
+            self.failed = True
+        if captures:
+            out, err = captures
+            out.seek(0)
+            err.seek(0)
+            record = {'input': source, 'output': out.read(), 'error': err.read(), 'failed': self.failed}
+            if self.record is not None:
+                for key in ('wall', 'cpu', 'memory'):
+                    record[key] = self.record[key]
+            output.write(_json_line(record))
+        return self.failed
 
+    # waits for every job that hasn't been reported yet, and reports it to output
+    # returns whether any of them didn't finish successfully
+    def _finish_batch_jobs(self, output, structured):
+        failed = False
+        for job in job_manager.jobs.values():
+            if job.reported:
+                continue
+            # waits in steps, since a wait without a timeout can't be interrupted
+            while not job.done.wait(0.1):
+                pass
+            job.reported = True
+            failed = failed or job.status != 'done'
+            if structured:
+                output.write(_json_line({'job': job.id, 'input': job.source, 'output': job.output.getvalue(),
+                                         'error': job.error or '', 'failed': job.status != 'done',
+                                         'wall': job.elapsed()}))
+            else:
+                output.write(_job_report(job))
+        return failed
+
+    # lines are only added to the history when they're read through readline, as they are
+    #  for readline's own history
+    # readline is only used if sys.stdout is the real stdout when raw_input() is called, so
+    #  it's put back for the call. the pre-input hook set up below swaps the router in again
+    #  as soon as readline has started, so output from background jobs is still routed while
+    #  the console waits for input
     def raw_input(self, prompt=''):
-        s = raw_input(str(prompt))
+        self.report_jobs()
+        self.report_tasks()
+        if args.auto_reload and function_files.changed():
+            self.auto_reload()
+        if self.interactive:
+            sys.stdout = sys.__stdout__
+        try:
+            s = raw_input(str(prompt))
+        finally:
+            sys.stdout = stdout_router
         log_file_obj.write(str(prompt._prev()) + s + '\n')
+        if s and self.interactive:
+            history_store.append(s)
         return s
 
+    # reloads the function files that have changed, as the statement "reload"
+    def auto_reload(self):
+        log_file_obj.write('[auto reload]\n')
+        self.source = 'reload'
+        self.runcode(functools.partial(reload_functions, ''))
+
+    # prints a line for each background job that has finished since the last prompt
+    def report_jobs(self):
+        for job in job_manager.take_finished():
+            if not job.reported:
+                job.reported = True
+                sys.__stdout__.write(_job_summary(job) + '\n')
+
+    # prints a line for each task that has finished since the last prompt, unless a
+    #  statement awaited it
+    def report_tasks(self):
+        for task in event_loop.take_finished():
+            if not task.awaited and not task.reported:
+                task.reported = True
+                task.output.flush()
+                sys.__stdout__.write(_task_summary(task) + '\n')
+                log_file_obj.write(_task_summary(task) + '\n')
+                log_file_obj.submit()
+
+    # runs the statement "await <expression>", or "<target> = await <expression>"
+    # the expression's value is awaited as a task on the event loop, unless it's a future
+    #  or task already, and the result is bound to target or displayed like an expression's.
+    #  a Ctrl-C cancels the task
+    def await_statement(self, expression, target=None):
+        if not expression.strip():
+            raise SyntaxError('Expected an expression to await.')
+        value = eval(self._compile_command_eval(expression), self.locals)
+        if isinstance(value, console_async.Future):
+            task = value
+        else:
+            if not isinstance(value, types.GeneratorType):
+                value = console_async.await_value(value)
+            task = event_loop.create_task(value, source=expression.strip(), awaited=True)
+            # listed by the tasks command until it finishes, even after a Ctrl-C, in case it
+            #  catches the CancelledError and carries on
+            task.add_done_callback(lambda task: event_loop.tasks.pop(task.id, None))
+        result = event_loop.wait(task)
+        if target is None:
+            sys.displayhook(result)
+            return
+        names = {'_await_result': result}
+        exec self._compile_command('{:s} = _await_result'.format(target)) in self.locals, names
+        del names['_await_result']
+        self.locals.update(names)
+
+    # starts source running as a background job
+    # expressions are evaluated, so their value can be bound when they finish, and anything
+    #  else is interpreted like console input, so special commands can run as jobs too
+    def submit_job(self, source, process=False):
+        source = source.strip()
+        code = None
+        context = None
+        expression = False
+        if source.split(' ', 1)[0] not in self.dispatch_table and not source.startswith('%'):
+            try:
+                code = compile(source, '<job>', 'eval')
+                expression = True
+            except SyntaxError:
+                pass
+        if code is None:
+            code, context = self.interpert_source(source, '<job>', 'exec')
+            if code is None:
+                raise SyntaxError('The job "{:s}" is incomplete.'.format(source))
+            if context is self.locals:
+                context = None
+        job = job_manager.submit(source, code, context, expression, process)
+        print '[job {:d}] started'.format(job.id)
+
     def interpert_source(self, source, filename="<input>", symbol="single"):
         code = str(source)
         if not code:
             return '', self.locals
         if code[0] == "%":
-            return 'print shell("{:s}")'.format(code[1:]), self.extended_locals()
+            if 'print_shell' in self.locals:
+                return functools.partial(self.locals['print_shell'], code[1:]), None
+            return self._compile_command('print_shell({!r})'.format(code[1:])), self.extended_locals()
+        # a trailing "&" isn't valid python, so it starts the rest of the input as a job, as
+        #  long as the rest is a special command or compiles. if it doesn't, the input is
+        #  compiled as it is, so it continues on the next line or its SyntaxError is shown
+        if code.rstrip().endswith('&'):
+            if code.lstrip().split(' ', 1)[0] in self.dispatch_table:
+                return functools.partial(self.submit_job, code.rstrip()[:-1]), None
+            job_source = _job_marker(code)
+            if job_source is not None:
+                try:
+                    complete = self.compile(job_source, filename, 'exec') is not None
+                except (OverflowError, SyntaxError, ValueError):
+                    complete = False
+                if complete:
+                    return functools.partial(self.submit_job, job_source), None
+        # await isn't part of python 2, so an assignment of an await is run here, and a
+        #  plain await is the await command
+        match = _await_assignment.match(code)
+        if match:
+            return functools.partial(self.await_statement, match.group(2), match.group(1)), None
         if ' ' in code.lstrip():
             cmd, args = code.lstrip().split(' ', 1)
         elif code.isalnum():
             cmd = code
             args = ''
         else:
-            return self.compile(source, filename, symbol), self.locals
-        if cmd in special_commands:
-            invocation = special_commands[cmd]['invocation']
-            code = invocation.format(args)
-            return code, self.extended_locals()
-        return self.compile(source, filename, symbol), self.locals
+            return self._compile_source(source, filename, symbol), self.locals
+        if cmd in self.dispatch_table:
+            function, invocation = self.dispatch_table[cmd]
+            if function:
+                try:
+                    # decoded like the string literal it would have been formatted into
+                    return functools.partial(function, args.decode('string_escape')), None
+                except ValueError:
+                    pass
+            return self._compile_command(invocation.format(args)), self.extended_locals()
+        return self._compile_source(source, filename, symbol), self.locals
+
+    # compiles input the way the interactive console does, reusing earlier results
+    # the compiler's flags are part of the key, since a __future__ import changes them
+    def _compile_source(self, source, filename, symbol):
+        key = (source, filename, symbol, self.compile.compiler.flags)
+        return self.code_cache.get(key, self.compile, source, filename, symbol)
+
+    # compiles a special command's formatted invocation, reusing earlier results
+    def _compile_command(self, source):
+        return self.code_cache.get((source, '<command>'), compile, source, '<command>', 'exec')
+
+    def _compile_command_eval(self, source):
+        return self.code_cache.get((source, '<await>'), compile, source, '<await>', 'eval')
 
     def extended_locals(self):
-        extended_locals = dict(self.locals)
-        extended_locals.update({f['function'].func_name: f['function'] for f in special_commands.values()})
-        return extended_locals
+        return self.command_namespace
+
+    # rebuilds what's derived from special_commands: the names that the commands'
+    #  functions are available under, and the table that commands are dispatched from
+    # each entry in the table is the function to call with the command's arguments as a
+    #  string, or None if the invocation has to be formatted and compiled, and the invocation
+    # needs to be called whenever special_commands changes
+    def update_special_commands(self):
+        self.command_namespace.functions = {f['function'].func_name: f['function'] for f in self.special_commands.values()}
+        self.dispatch_table = {}
+        for command, entry in self.special_commands.items():
+            function = None
+            match = _string_invocation.match(entry['invocation'])
+            if match and match.group(1) == entry['function'].func_name:
+                function = entry['function']
+            self.dispatch_table[command] = (function, entry['invocation'])
+        if self.completer is not None:
+            self.completer.update_commands()
 
 # define and register a function to clear the current log
 def clear_log():
-    log_file_obj.seek(0,0)
-    log_file_obj.truncate()
+    log_file_obj.clear()
+
+register_command = lib_tools.register_command
+register_function = lib_tools.register_function
+
+detail_dict = {'Returns:': {'<info>': 'A dict of the hits, misses, current size and maximum size (set with --code_cache_size) of the cache'}}
+@register_function('Return how often input was found already compiled in the cache of compiled console input and special commands.', detail_dict=detail_dict)
+def code_cache_info():
+    return console.code_cache.info()
+
+detail_dict = ['Usage: "stats[ <count>][ wall|cpu|memory]"',
+               {'<count>': 'Number of statements to show. Default is 10.',
+                'wall|cpu|memory': 'What to rank the statements by. Default is wall.'}]
+@register_command('stats', invocation='print_stats("{:s}")', description='Print the statements that took the longest to run or raised peak memory use the most.', detail_dict=detail_dict)
+def print_stats(arguments=''):
+    count = 10
+    key = 'wall'
+    for argument in arguments.split():
+        if argument.isdigit():
+            count = int(argument)
+        elif argument in ('wall', 'cpu', 'memory'):
+            key = argument
+        else:
+            raise ValueError('Expected a count or one of wall, cpu or memory, not "{:s}".'.format(argument))
+    print '{:>8s}{:>12s}{:>12s}{:>12s}  {:s}'.format('time', 'wall', 'cpu', 'memory', 'input')
+    for record in heapq.nlargest(count, console.statement_stats.records, key=lambda record: record[key]):
+        source = record['source'].strip()
+        if '\n' in source or len(source) > 60:
+            source = source.split('\n')[0][:57] + '...'
+        print '{:>8s}{:>12s}{:>12s}{:>12s}  {:s}'.format('[{:d}]'.format(record['time']), _format_seconds(record['wall']),
+                                                        _format_seconds(record['cpu']), _format_bytes(record['memory']), source)
+
+detail_dict = ['Usage: "timeit <statement>"',
+               {'<statement>': 'Python statement to time, run in the console\'s namespace.'}]
+@register_command('timeit', invocation='time_statement("{:s}")', description='Time a statement, running it enough times to take at least 0.2 seconds.', detail_dict=detail_dict)
+def time_statement(statement):
+    import timeit
+    code = compile(statement, '<timeit>', 'exec')
+    def run():
+        exec code in console.locals
+    timer = timeit.Timer(run)
+    number = 1
+    while True:
+        seconds = timer.timeit(number)
+        if seconds >= 0.2 or number >= 10 ** 9:
+            break
+        number *= 10
+    best = min([seconds] + timer.repeat(2, number)) / number
+    print '{:d} loops, best of 3: {:s} per loop'.format(number, _format_seconds(best))
+
+detail_dict = ['Usage: "prof <expression>"',
+               {'<expression>': 'Python expression or statement to profile, run in the console\'s namespace.'}]
+@register_command('prof', invocation='profile_statement("{:s}")', description='Profile an expression with cProfile and print the 20 functions with the highest cumulative time.', detail_dict=detail_dict)
+def profile_statement(statement):
+    import cProfile, pstats
+    try:
+        code = compile(statement, '<prof>', 'eval')
+    except SyntaxError:
+        code = compile(statement, '<prof>', 'exec')
+    profile = cProfile.Profile()
+    result = profile.runcall(eval, code, console.locals)
+    pstats.Stats(profile, stream=sys.stdout).sort_stats('cumulative').print_stats(20)
+    if result is not None:
+        print repr(result)
+
+detail_dict = ['Usage: "history[ <text>]"',
+               {'<text>': 'Text to search for, starting at the start of a word. If none, prints the most recent entries.'}]
+@register_command('history', invocation='print_history("{:s}")', description='Print the 20 most recent distinct history entries containing some text, from the whole history file.', detail_dict=detail_dict)
+def print_history(text=''):
+    for entry in history_store.search(text, limit=20):
+        print entry
+
+# parses a time given to logsearch as seconds since the epoch, a UTC date and time like
+#  "2026-01-31 13:00", or a time ago like 90s, 30m, 2h or 7d
+def _parse_log_time(value):
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', value)
+    if match:
+        return time.time() - float(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for date_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(value, date_format))
+        except ValueError:
+            pass
+    raise ValueError('Expected a time like 1790000000, "2026-01-31 13:00" or 2h, not "{:s}".'.format(value))
+
+detail_dict = ['Usage: "logsearch[ session=<id>|current][ since=<time>][ until=<time>][ limit=<count>][ <text>]"',
+               {'session=<id>': 'Only statements from this session. "current" is this session.',
+                'since=<time>': 'Only statements from this time on. Times can be seconds since the epoch, a UTC date and time like "2026-01-31 13:00" (quoted), or a time ago like 90s, 30m, 2h or 7d.',
+                'until=<time>': 'Only statements from before this time.',
+                'limit=<count>': 'Number of statements to show, the most recent that match. Default is 20.',
+                '<text>': 'Only statements with this text in their input, output or errors.'}]
+@register_command('logsearch', invocation='search_log("{:s}")', description="Search the structured log of every session's statements.", detail_dict=detail_dict)
+def search_log(arguments=''):
+    # the records printed aren't captured again, so later searches don't find them twice
+    stdout_logger.capture = None
+    options = {'session': None, 'since': None, 'until': None, 'limit': '20'}
+    words = []
+    for argument in shlex.split(arguments):
+        name, equals, value = argument.partition('=')
+        if equals and name in options:
+            options[name] = value
+        else:
+            words.append(argument)
+    if options['session'] == 'current':
+        if session_log is None:
+            raise ValueError('This session is not writing to the structured log.')
+        options['session'] = session_log.session
+    for name in ('since', 'until'):
+        if options[name] is not None:
+            options[name] = _parse_log_time(options[name])
+    if session_log is not None:
+        session_log.flush()
+    records = console_session_log.search(structured_log_file, ' '.join(words), session=options['session'],
+                                         since=options['since'], until=options['until'], limit=int(options['limit']))
+    for record in records:
+        formatted_time = datetime.datetime.utcfromtimestamp(record['time']).strftime('%Y-%m-%d %H:%M:%S')
+        print '[{:s} UTC, session {:s}]'.format(formatted_time, record['session'])
+        print '> ' + record['input'].rstrip('\n').replace('\n', '\n. ')
+        sys.stdout.write(record['output'] + record['error'])
+
+detail_dict = ['Usage: "reload[ <file>]"',
+               {'<file>': 'default, custom or project, or the name of the file. If none, reloads each function file that has changed since it was loaded.'}]
+@register_command('reload', invocation='reload_functions("{:s}")', description='Run a function file again after editing it, updating the functions, commands and variables it registers without restarting. Names assigned at the prompt since the file was loaded are kept.', detail_dict=detail_dict)
+def reload_functions(name=''):
+    if name.strip():
+        names = [function_files.find(name.strip())]
+    else:
+        names = function_files.changed()
+        if not names:
+            print 'No function files have changed.'
+    for name in names:
+        summary = function_files.reload(name, console.locals, console.special_commands, lib_tools.export_dict['help_function_info'])
+        console.update_special_commands()
+        if console.completer is not None:
+            console.completer.invalidate()
+        print 'Reloaded {:s}'.format(function_files.files[name]['path'])
+        if summary['removed']:
+            print '  removed ' + ', '.join(summary['removed'])
+        if summary['kept']:
+            print '  kept ' + ', '.join(summary['kept']) + ', assigned since the file was loaded'
+
+# splits the arguments of save and restore into the snapshot's directory and the names
+def _snapshot_arguments(arguments):
+    path = snapshot_dir
+    names = []
+    for argument in shlex.split(arguments):
+        if argument.startswith('path='):
+            path = os.path.expanduser(argument[len('path='):])
+        else:
+            names.append(argument)
+    return console_snapshot.Snapshot(path), names or None
+
+# returns the names in the namespace that are still bound to what the console or the
+#  function files bound them to, which every session binds again anyway
+def _startup_names():
+    bound = dict(initial_namespace)
+    bound.update(function_files.merged()[0])
+    return set(name for name, value in bound.items() if console.locals.get(name) is value)
+
+detail_dict = ['Usage: "save[ path=<directory>][ <name> ...]"',
+               {'path=<directory>': 'Directory of the snapshot. Default is <log file>.snapshot.',
+                '<name>': 'Names to save, leaving the rest of the snapshot as it is. If none, saves the whole namespace in place of the snapshot, except what the function files bound.'}]
+@register_command('save', invocation='save_namespace("{:s}")', description='Save the variables in the namespace that can be pickled to a snapshot, for "restore" to load in a later session. Saving to the same snapshot again only rewrites the variables that changed. Large numpy arrays are saved so that restoring them maps them instead of reading them.', detail_dict=detail_dict)
+def save_namespace(arguments=''):
+    snapshot, names = _snapshot_arguments(arguments)
+    summary = snapshot.save(console.locals, names, exclude=_startup_names())
+    print 'Saved {:d} variables to {:s}, writing {:d} ({:s})'.format(len(summary['saved']), snapshot.path,
+                                                                   len(summary['written']), _format_bytes(summary['bytes']))
+    for name, reason in sorted(summary['skipped'].items()):
+        print "  skipped {:s}: {:s}".format(name, reason)
+
+# prints what a restore did, to stream
+def _print_restore(snapshot, summary, stream):
+    stream.write('Restored {:d} variables from {:s}\n'.format(len(summary['restored']), snapshot.path))
+    for name, reason in sorted(summary['failed'].items()):
+        stream.write("  couldn't restore {:s}: {:s}\n".format(name, reason))
+
+detail_dict = ['Usage: "restore[ path=<directory>][ <name> ...]"',
+               {'path=<directory>': 'Directory of the snapshot. Default is <log file>.snapshot.',
+                '<name>': 'Names to restore. If none, restores every variable in the snapshot.'}]
+@register_command('restore', invocation='restore_namespace("{:s}")', description='Restore the variables saved with "save", replacing any with the same names.', detail_dict=detail_dict)
+def restore_namespace(arguments=''):
+    snapshot, names = _snapshot_arguments(arguments)
+    _print_restore(snapshot, snapshot.restore(console.locals, names), sys.stdout)
+
+def _describe_type(value):
+    description = type(value).__name__
+    shape = getattr(value, 'shape', None)
+    if isinstance(shape, tuple):
+        description += ' ' + 'x'.join(str(size) for size in shape)
+    elif isinstance(value, (list, tuple, dict, set, frozenset, str, unicode)):
+        description += ' of {:d}'.format(len(value))
+    return description
+
+detail_dict = ['Usage: "mem[ <count>][ refresh]"',
+               {'<count>': 'Number of variables to show. Default is 20.',
+                'refresh': 'Include to measure every variable again, instead of only the ones that may have changed.'}]
+@register_command('mem', invocation='print_memory("{:s}")', description='Print the variables in the namespace that use the most memory, counting everything they reach. Sizes are cached, and only measured again for variables that statements have used since.', detail_dict=detail_dict)
+def print_memory(arguments=''):
+    count = 20
+    refresh = False
+    for argument in arguments.split():
+        if argument.isdigit():
+            count = int(argument)
+        elif argument == 'refresh':
+            refresh = True
+        else:
+            raise ValueError('Expected a count or refresh, not "{:s}".'.format(argument))
+    sizes = memory_sizes.all_sizes(exclude=_startup_names(), refresh=refresh)
+    print 'Resident memory {:s}, variables {:s}'.format(_format_bytes(console.statement_stats.memory_reader.rss()),
+                                                       _format_bytes(sum(size for _, size in sizes)))
+    for name, size in sizes[:count]:
+        print '{:>10s}  {:s} ({:s})'.format(_format_bytes(size), name, _describe_type(console.locals[name]))
+
+detail_dict = ['Usage: "memdiff[ <count>]"',
+               {'<count>': 'Number of statements to show. Default is 10.'}]
+@register_command('memdiff', invocation='print_memory_changes("{:s}")', description='Print the statements that allocated the most memory that they kept, with the variables they used and how much memory those hold now. With --trace_memory and tracemalloc installed, also prints the lines that allocated the memory.', detail_dict=detail_dict)
+def print_memory_changes(arguments=''):
+    count = int(arguments) if arguments.strip() else 10
+    startup_names = _startup_names()
+    print '{:>8s}{:>12s}{:>12s}  {:s}'.format('time', 'allocated', 'peak', 'input')
+    for record in heapq.nlargest(count, console.statement_stats.records, key=lambda record: record['allocated']):
+        if record['allocated'] <= 0:
+            break
+        source = record['source'].strip()
+        if '\n' in source or len(source) > 60:
+            source = source.split('\n')[0][:57] + '...'
+        print '{:>8s}{:>12s}{:>12s}  {:s}'.format('[{:d}]'.format(record['time']), _format_change(record['allocated']),
+                                                 _format_change(record['memory']), source)
+        names = [name for name in record.get('names', ()) if name in console.locals and name not in startup_names]
+        if names:
+            print '  holds ' + ', '.join('{:s} {:s}'.format(name, _format_bytes(memory_sizes.size(name))) for name in names)
+        for line in record.get('where', ()):
+            print '  ' + line
+
+detail_dict = ['Usage: "free <name> ..."',
+               {'<name>': 'Names of the variables to delete.'}]
+@register_command('free', invocation='free_memory("{:s}")', description='Delete variables, collect garbage and return freed memory to the system, then print how much memory the variables held and how much the resident set size fell. Also clears the last traceback and the "_" result, which can keep objects alive.', detail_dict=detail_dict)
+def free_memory(arguments):
+    names = sorted(set(arguments.split()))
+    if not names:
+        raise ValueError('Expected the names of the variables to free.')
+    for name in names:
+        if name not in console.locals:
+            raise NameError("name '{:s}' is not defined".format(name))
+    values = dict((id(console.locals[name]), name) for name in names)
+    held = sum(memory_sizes.size(name) for name in values.values())
+    # besides the references from the names being freed and from "_", there's one from value
+    #  and one from getrefcount's argument
+    shared = []
+    for name in names:
+        value = console.locals[name]
+        expected = 2 + len([other for other in names if console.locals[other] is value])
+        if getattr(__builtin__, '_', None) is value:
+            expected += 1
+        if sys.getrefcount(value) > expected:
+            shared.append(name)
+    del value
+    before = console.statement_stats.memory_reader.rss()
+    for name in names:
+        del console.locals[name]
+    sys.last_type = sys.last_value = sys.last_traceback = None
+    if hasattr(__builtin__, '_'):
+        __builtin__._ = None
+    gc.collect()
+    console_memory.trim()
+    print 'Freed {:s}, which held {:s}; resident memory fell by {:s}'.format(
+        ', '.join(names), _format_bytes(held), _format_bytes(max(0, before - console.statement_stats.memory_reader.rss())))
+    if shared:
+        print '  {:s} still referenced from elsewhere, so may not have been freed'.format(', '.join(shared))
+
+# returns a line describing a job, for the jobs command and the notices that jobs finished
+def _job_summary(job):
+    summary = '[job {:d}] {:s} {:s} after {:s}: {:s}'.format(job.id, job.kind, job.status, _format_seconds(job.elapsed()), job.source)
+    if job.status == 'running':
+        summary = '[job {:d}] {:s} running for {:s}: {:s}'.format(job.id, job.kind, _format_seconds(job.elapsed()), job.source)
+    if job.error:
+        summary += '\n  ' + job.error.strip().split('\n')[-1]
+    if job.bound:
+        summary += '\n  bound ' + ', '.join(job.bound)
+    if job.skipped:
+        summary += "\n  couldn't pickle " + ', '.join(job.skipped)
+    return summary
+
+# writes a job's output to the log as it finishes, each line tagged with the job's id
+def _log_job(job):
+    lines = ['[job {:d}] {:s}\n'.format(job.id, line) for line in job.output.getvalue().splitlines()]
+    if job.error:
+        lines += ['[job {:d}] {:s}\n'.format(job.id, line) for line in job.error.splitlines()]
+    log_file_obj.write(''.join(lines) + _job_summary(job) + '\n')
+    log_file_obj.submit()
+
+@register_command('bg', invocation='start_job("{:s}")', description='Run a statement, expression or special command as a background job on a thread. Ending a line with "&" does the same.', detail_dict=['Usage: "bg <statement>"'])
+def start_job(statement):
+    console.submit_job(statement)
+
+@register_command('bgp', invocation='start_process_job("{:s}")', description='Run a statement, expression or special command as a background job in a new process, for work that needs more than one core. Only the names it assigns that can be pickled, and the value of an expression, come back to the console.', detail_dict=['Usage: "bgp <statement>"'])
+def start_process_job(statement):
+    console.submit_job(statement, process=True)
+
+@register_command('jobs', invocation='print_jobs()', description='List the background jobs and their status.')
+def print_jobs():
+    for job in job_manager.jobs.values():
+        job.reported = job.done.is_set()
+        print _job_summary(job)
+
+# returns what a finished job printed, how it ended and what it bound
+def _job_report(job):
+    report = job.output.getvalue()
+    if job.error:
+        report += job.error
+    report += _job_summary(job) + '\n'
+    if job.result is not None:
+        report += repr(job.result) + '\n'
+    return report
+
+def _print_job(job):
+    job.reported = True
+    sys.stdout.write(_job_report(job))
+
+detail_dict = ['Usage: "wait[ <id>]"',
+               {'<id>': 'Id of the job to wait for. If none, waits for every running job.'}]
+@register_command('wait', invocation='wait_job("{:s}")', description="Wait for a background job to finish, then print its output and result. Ctrl-C stops waiting without stopping the job.", detail_dict=detail_dict)
+def wait_job(id=''):
+    if id.strip():
+        jobs = [job_manager.get(int(id))]
+    else:
+        jobs = [job for job in job_manager.jobs.values() if not job.done.is_set()]
+    for job in jobs:
+        # waits in steps, since a wait without a timeout can't be interrupted
+        while not job.done.wait(0.1):
+            pass
+        _print_job(job)
+
+detail_dict = ['Usage: "kill <id>"',
+               {'<id>': 'Id of the job to kill.'}]
+@register_command('kill', invocation='kill_job("{:s}")', description="Kill a background job. A thread job stops the next time it runs python code, so one blocked in a long call stops once the call returns.", detail_dict=detail_dict)
+def kill_job(id):
+    if not job_manager.kill(int(id)):
+        print '[job {:d}] has already finished'.format(int(id))
+
+# returns a line describing a task, for the tasks command and the notices that tasks finished
+def _task_summary(task):
+    if task.status() == 'running':
+        summary = '[task {:d}] running for {:s}: {:s}'.format(task.id, _format_seconds(task.elapsed()), task.source)
+    else:
+        summary = '[task {:d}] {:s} after {:s}: {:s}'.format(task.id, task.status(), _format_seconds(task.elapsed()), task.source)
+    error = task.error()
+    if error:
+        summary += '\n  ' + error.strip().split('\n')[-1]
+    elif task.status() == 'done' and task.result() is not None:
+        summary += '\n  ' + _truncated_repr(task.result())
+    return summary
+
+def _truncated_repr(value):
+    text = repr(value)
+    return text if len(text) <= 80 else text[:77] + '...'
+
+detail_dict = ['Usage: "await <expression>" or "<name> = await <expression>"',
+               {'<expression>': 'A coroutine (a generator that yields what it waits for, and returns with "raise event_loop.Return(value)"), a future or task, or a list of them.',
+                '<name>': 'Name, attribute or comma-separated names to bind the result to. If none, the result is printed like an expression\'s.'}]
+@register_command('await', invocation='await_command({!r})', description='Run a coroutine on the event loop that lives for the whole session, and wait for its result. Tasks it starts with event_loop.create_task() keep running between prompts (see "tasks"). Ctrl-C cancels it.', detail_dict=detail_dict)
+def await_command(expression):
+    console.await_statement(expression)
+
+detail_dict = ['Usage: "tasks[ cancel <id>|all]"',
+               {'cancel <id>|all': 'Cancel a task, or every running task, by raising event_loop.CancelledError where it\'s waiting. If none, lists the tasks.'}]
+@register_command('tasks', invocation='manage_tasks("{:s}")', description='List the tasks running on the event loop, started with event_loop.create_task(), and the ones that have finished, or cancel them.', detail_dict=detail_dict)
+def manage_tasks(arguments=''):
+    arguments = arguments.split()
+    if not arguments:
+        for task in event_loop.tasks.values():
+            task.reported = task.done()
+            print _task_summary(task)
+        return
+    if arguments[0] != 'cancel' or len(arguments) != 2:
+        raise ValueError('Expected "cancel <id>" or "cancel all", not "{:s}".'.format(' '.join(arguments)))
+    if arguments[1] == 'all':
+        tasks = [task for task in event_loop.tasks.values() if not task.done()]
+    else:
+        tasks = [event_loop.get(int(arguments[1]))]
+    for task in tasks:
+        if task.cancel():
+            print '[task {:d}] cancelling'.format(task.id)
+        else:
+            print '[task {:d}] has already finished'.format(task.id)
 
 # console_local_variables is a dictionary of local variables to be passed into the console
 console_local_variables = {}
 console_local_variables['clear_log'] = clear_log
 
-# register variables and special commands defined in the project and default files
-special_commands = {}
-for module in ('default_functions', 'custom_functions', 'project_functions'):
-    if module not in vars() or not vars()[module]:
-        continue
-    module = vars()[module]
-    for var in module.export_dict:
-        if var == '~special_commands':
-            for command in module.export_dict[var]:
-                special_commands[command] = module.export_dict[var][command]
-        else:
-            console_local_variables[var] = module.export_dict[var]
+# the deep sizes of the namespace's variables, for mem, memdiff and free
+console_memory = load_console_module('console_memory')
+memory_sizes = console_memory.Size_Cache(console_local_variables)
+
+# background jobs run in the console's namespace, with their output routed to the job
+#  instead of the terminal while they run
+console_jobs = load_console_module('console_jobs')
+job_manager = console_jobs.Job_Manager(console_local_variables, threads=args.job_threads,
+                                       output_limit=args.job_output_limit, on_finish=_log_job,
+                                       on_fork=log_file_obj.detach)
+stdout_router = job_manager.router(sys.__stdout__)
+sys.stdout = stdout_router
+sys.stderr = job_manager.router(stderr_logger)
+# see LoggedConsole.raw_input()
+readline.set_pre_input_hook(lambda: setattr(sys, 'stdout', stdout_router))
+
+# what a task prints is written to the terminal as it's printed, and to the log a line at a
+#  time, each line tagged with the task's id, instead of going through stdout_logger, which
+#  would log it as the output of whatever statement is running
+class Task_Output():
+    def __init__(self, task):
+        self.task = task
+        self.partial = ''
+
+    def write(self, string):
+        sys.__stdout__.write(string)
+        sys.__stdout__.flush()
+        lines = (self.partial + string).split('\n')
+        self.partial = lines.pop()
+        if lines:
+            log_file_obj.write(''.join('[task {:d}] {:s}\n'.format(self.task.id, line) for line in lines))
+            log_file_obj.submit()
+
+    # logs what's left of an unfinished line
+    def flush(self):
+        if self.partial:
+            self.write('\n')
+
+# the event loop that "await" statements and tasks run on, which lives for the whole
+#  session. its thread is only started by the first task
+console_async = load_console_module('console_async')
+event_loop = console_async.Event_Loop(job_manager.local, Task_Output)
+atexit.register(event_loop.stop)
+
+# register variables and special commands defined in the default, custom and project files,
+#  then the console's own special commands
+variables, special_commands = function_files.merged()[:2]
+console_local_variables.update(variables)
+for var in lib_tools.export_dict['export_dict']:
+    if var == '~special_commands':
+        special_commands.update(lib_tools.export_dict['export_dict'][var])
+    else:
+        console_local_variables[var] = lib_tools.export_dict['export_dict'][var]
+profiler.phase('build namespace')
 
 # start the interperter with console features
-readline.set_completer(rlcompleter.Completer(console_local_variables).complete)
-readline.parse_and_bind("tab: complete")
-LoggedConsole(locals=console_local_variables, special_commands=special_commands).interact(banner=banner)
+console = LoggedConsole(locals=console_local_variables, special_commands=special_commands)
+profiler.phase('create console')
+if not args.batch:
+    console_completion = load_console_module('console_completion')
+    console.completer = console_completion.Completer(console_local_variables, special_commands,
+                                                     lib_tools.export_dict['help_function_info'])
+    readline.set_completer(console.completer.complete)
+    readline.parse_and_bind("tab: complete")
+    profiler.phase('set up completion')
+profiler.report(sys.__stderr__)
+console_local_variables['event_loop'] = event_loop
+# what the namespace held before anything was run, which save leaves out
+initial_namespace = dict(console_local_variables)
+console_snapshot = load_console_module('console_snapshot')
+if args.auto_restore:
+    snapshot = console_snapshot.Snapshot(snapshot_dir)
+    if snapshot.exists():
+        _print_restore(snapshot, snapshot.restore(console_local_variables), sys.__stderr__)
+if args.batch:
+    batch_input = sys.stdin if args.batch == '-' else open(args.batch)
+    sys.exit(console.run_batch(batch_input, stop_on_error=not args.continue_on_error,
+                               structured=args.batch_format == 'jsonl'))
+console.interact(banner=banner)
 
 exit()
@@ -2,18 +2,37 @@
 
 function pycon() {
   if [ "$1" == "--uninstall" ] ; then
+    python ~/.pycon/console_client.py --stop_server > /dev/null
     sed -i "/# add the pycon command to bash/d" ~/.bashrc
     sed -i "/source ~\/.pycon\/runscript.sh/d" ~/.bashrc
     rm ~/.pycon/console_lib_tools.py
+    rm ~/.pycon/console_cache.py
+    rm ~/.pycon/console_log.py
+    rm ~/.pycon/console_shell.py
+    rm ~/.pycon/console_completion.py
+    rm ~/.pycon/console_history.py
+    rm ~/.pycon/console_session_log.py
+    rm ~/.pycon/console_jobs.py
+    rm ~/.pycon/console_server.py
+    rm ~/.pycon/console_client.py
+    rm ~/.pycon/console_reload.py
+    rm ~/.pycon/console_snapshot.py
+    rm ~/.pycon/console_memory.py
+    rm ~/.pycon/console_parallel.py
+    rm ~/.pycon/console_async.py
+    rm -f ~/.pycon/startup_cache
     rm ~/.pycon/default_functions.py
     rm ~/.pycon/python_console.py
     rm ~/.pycon/*.pyc
     rm ~/.pycon/runscript.sh
   elif [ "$1" == "--purge" ] ; then
+    python ~/.pycon/console_client.py --stop_server > /dev/null
     sed -i "/# add the pycon command to bash/d" ~/.bashrc
     sed -i "/source ~\/.pycon\/runscript.sh/d" ~/.bashrc
     rm -rf ~/.pycon
   else
-    python ~/.pycon/python_console.py "$@"
+    # the client connects to the console server if there is one, and otherwise runs
+    #  python_console.py itself. -S skips loading site, which the client doesn't need
+    python -S ~/.pycon/console_client.py "$@"
   fi
 }